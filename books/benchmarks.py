@@ -0,0 +1,318 @@
+import os
+from random import Random
+from time import perf_counter
+from xml.sax.saxutils import escape, quoteattr
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from rest_framework.settings import api_settings
+
+from .models import Book
+from .pagination import encode_cursor
+
+
+ADJECTIVES = (
+    'Ancient', 'Bright', 'Broken', 'Curious', 'Distant', 'Forgotten', 'Golden',
+    'Hidden', 'Lonely', 'Northern', 'Quiet', 'Red', 'Secret', 'Silent',
+    'Strange', 'Wandering', 'Wild', 'Winter',
+)
+BOOKSHELVES = (
+    'Adventure', 'Best Books Ever Listings', 'Children\'s Fiction', 'Crime Fiction',
+    'Detective Fiction', 'Fantasy', 'Gothic Fiction', 'Harvard Classics',
+    'Historical Fiction', 'Humor', 'Movie Books', 'Mystery Fiction', 'Poetry',
+    'Philosophy', 'Romance', 'Science Fiction', 'Short Stories', 'Travel',
+    'US Civil War', 'Westerns',
+)
+FORMS = (
+    'Biography', 'Correspondence', 'Drama', 'Fiction', 'History', 'Humor',
+    'Juvenile fiction', 'Poetry',
+)
+GIVEN_NAMES = (
+    'Anne', 'Arthur', 'Charles', 'Charlotte', 'Edith', 'Elizabeth', 'Emily',
+    'George', 'Henry', 'Jane', 'Johann', 'Louisa', 'Marie', 'Mark', 'Mary',
+    'Oscar', 'Robert', 'Thomas', 'Victor', 'William',
+)
+LANGUAGES = (('en', 80), ('fr', 6), ('de', 5), ('fi', 3), ('nl', 2), ('it', 2),
+             ('es', 1), ('pt', 1))
+NOUNS = (
+    'Castle', 'City', 'Country', 'Daughter', 'Garden', 'Harbour', 'House',
+    'Island', 'Journey', 'King', 'Letters', 'Mountain', 'Prince', 'River',
+    'Road', 'Sea', 'Stranger', 'Valley', 'Voyage', 'Woman',
+)
+SURNAMES = (
+    'Alcott', 'Austen', 'Balzac', 'Brontë', 'Carroll', 'Conrad', 'Dickens',
+    'Doyle', 'Dumas', 'Eliot', 'Goethe', 'Hardy', 'Hugo', 'James', 'Kipling',
+    'London', 'Melville', 'Poe', 'Scott', 'Shelley', 'Stevenson', 'Tolstoy',
+    'Twain', 'Verne', 'Wells', 'Wharton', 'Wilde', 'Woolf',
+)
+TOPICS = (
+    'Adventure stories', 'Brothers and sisters', 'Courtship', 'Detectives',
+    'England', 'Families', 'France', 'Ghosts', 'Islands', 'Love stories',
+    'Magic', 'Monsters', 'Orphans', 'Pirates', 'Revolutions', 'Sea stories',
+    'Ship captains', 'Sisters', 'Voyages and travels', 'War',
+)
+
+RDF_HEADER = '''<?xml version="1.0" encoding="utf-8"?>
+<rdf:RDF xml:base="http://www.gutenberg.org/"
+  xmlns:dcam="http://purl.org/dc/dcam/"
+  xmlns:dcterms="http://purl.org/dc/terms/"
+  xmlns:marcrel="http://id.loc.gov/vocabulary/relators/"
+  xmlns:pgterms="http://www.gutenberg.org/2009/pgterms/"
+  xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+>
+'''
+
+
+def get_synthetic_people(random, count):
+    people = []
+    for _ in range(count):
+        birth = random.randint(1500, 1950)
+        people.append({
+            'name': '%s, %s' % (
+                random.choice(SURNAMES), random.choice(GIVEN_NAMES)
+            ),
+            'birth': birth if random.random() < 0.9 else None,
+            'death': birth + random.randint(25, 90) if random.random() < 0.85 else None,
+        })
+    return people
+
+
+def get_synthetic_rdf(id, random, people):
+    """
+    This makes the RDF file of a made-up book in the format of Project
+    Gutenberg's catalog.
+    """
+
+    node_ids = iter(range(1, 1000))
+    lines = [RDF_HEADER, '  <pgterms:ebook rdf:about="ebooks/%d">' % id]
+
+    def add_value(tag, member_of, value):
+        lines.extend([
+            '    <%s>' % tag,
+            '      <rdf:Description rdf:nodeID="N%d">' % next(node_ids),
+            '        <dcam:memberOf rdf:resource=%s/>' % quoteattr(member_of),
+            '        <rdf:value>%s</rdf:value>' % escape(value),
+            '      </rdf:Description>',
+            '    </%s>' % tag,
+        ])
+
+    def add_person(tag, person):
+        lines.extend([
+            '    <%s>' % tag,
+            '      <pgterms:agent>',
+            '        <pgterms:name>%s</pgterms:name>' % escape(person['name']),
+        ])
+        for field in ('birth', 'death'):
+            if person[field] is not None:
+                lines.append(
+                    '        <pgterms:%sdate>%d</pgterms:%sdate>'
+                    % (field, person[field], field)
+                )
+        lines.extend(['      </pgterms:agent>', '    </%s>' % tag])
+
+    rights = random.random()
+    if rights < 0.97:
+        rights = 'Public domain in the USA.'
+    elif rights < 0.99:
+        rights = 'Copyrighted. Read the copyright notice inside this book for details.'
+    else:
+        rights = 'Copyright status not determined.'
+    lines.append('    <dcterms:rights>%s</dcterms:rights>' % rights)
+    lines.append(
+        '    <pgterms:downloads>%d</pgterms:downloads>'
+        % int(random.paretovariate(1.2) * 10)
+    )
+
+    for person in random.sample(people, random.choice((1, 1, 1, 2, 3))):
+        add_person('dcterms:creator', person)
+    if random.random() < 0.05:
+        add_person('marcrel:edt', random.choice(people))
+    if random.random() < 0.1:
+        add_person('marcrel:trl', random.choice(people))
+
+    title = 'The %s %s' % (random.choice(ADJECTIVES), random.choice(NOUNS))
+    if random.random() < 0.2:
+        title += '\nOr, The %s of the %s' % (
+            random.choice(NOUNS), random.choice(NOUNS)
+        )
+    lines.append('    <dcterms:title>%s</dcterms:title>' % escape(title))
+    if random.random() < 0.3:
+        lines.append(
+            '    <pgterms:marc520>A story of %s and %s.</pgterms:marc520>' % (
+                random.choice(TOPICS).lower(), random.choice(TOPICS).lower()
+            )
+        )
+
+    language_codes = [code for code, weight in LANGUAGES for _ in range(weight)]
+    add_value(
+        'dcterms:language',
+        'http://purl.org/dc/terms/RFC4646',
+        random.choice(language_codes)
+    )
+    for _ in range(random.randint(1, 4)):
+        add_value(
+            'dcterms:subject',
+            'http://purl.org/dc/terms/LCSH',
+            '%s -- %s' % (random.choice(TOPICS), random.choice(FORMS))
+        )
+    add_value(
+        'dcterms:subject',
+        'http://purl.org/dc/terms/LCC',
+        random.choice(('PR', 'PS', 'PQ', 'PT'))
+    )
+    add_value(
+        'dcterms:type',
+        'http://purl.org/dc/terms/DCMIType',
+        'Text' if random.random() < 0.98 else 'Sound'
+    )
+    for bookshelf in random.sample(BOOKSHELVES, random.randint(0, 2)):
+        add_value('pgterms:bookshelf', '2009/pgterms/Bookshelf', bookshelf)
+
+    ebook_url = 'https://www.gutenberg.org/ebooks/%d' % id
+    formats = [
+        (ebook_url + '.html.images', 'text/html'),
+        (ebook_url + '.epub.images', 'application/epub+zip'),
+        (ebook_url + '.txt.utf-8', 'text/plain; charset=utf-8'),
+        (
+            'https://www.gutenberg.org/cache/epub/%d/pg%d.cover.medium.jpg'
+            % (id, id),
+            'image/jpeg'
+        ),
+    ]
+    if random.random() < 0.5:
+        formats.append((ebook_url + '.kf8.images', 'application/x-mobipocket-ebook'))
+    if random.random() < 0.5:
+        formats.insert(0, (ebook_url + '.epub.noimages', 'application/epub+zip'))
+    for url, mime_type in formats:
+        lines.extend([
+            '    <dcterms:hasFormat>',
+            '      <pgterms:file rdf:about=%s>' % quoteattr(url),
+        ])
+        add_value('dcterms:format', 'http://purl.org/dc/terms/IMT', mime_type)
+        lines.extend(['      </pgterms:file>', '    </dcterms:hasFormat>'])
+
+    lines.extend(['  </pgterms:ebook>', '</rdf:RDF>', ''])
+    return '\n'.join(lines)
+
+
+def write_synthetic_catalog(path, book_count, seed=0):
+    """
+    This writes RDF files for made-up books with IDs from 1 to `book_count` in
+    the layout of the catalog directory. The same seed gives the same books.
+    """
+
+    random = Random(seed)
+    people = get_synthetic_people(random, max(book_count // 3, 10))
+    for id in range(1, book_count + 1):
+        directory = os.path.join(path, str(id))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'pg%d.rdf' % id), 'w') as file:
+            file.write(get_synthetic_rdf(id, random, people))
+
+
+class QueryCounter:
+    """ This counts the database queries made while it is installed. """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def get_benchmark_urls(seed=0):
+    """
+    This gives names and URLs of representative API requests for the books in
+    the database.
+    """
+
+    random = Random(seed)
+    book_ids = list(Book.objects.values_list('gutenberg_id', flat=True))
+    book_count = len(book_ids)
+    page_size = api_settings.PAGE_SIZE
+    deep_offset = max(book_count - page_size * 2, 0)
+
+    deep_position = Book.objects.order_by('-download_count', '-id').values_list(
+        'download_count', 'id'
+    )[deep_offset:deep_offset + 1].first()
+
+    urls = [
+        ('list', '/books/'),
+        ('detail', '/books/%d/' % random.choice(book_ids)),
+        ('search', '/books/?search=wandering%20dickens'),
+        ('search_relevance', '/books/?search=the%20island&sort=relevance'),
+        ('topic', '/books/?topic=sea'),
+        ('languages', '/books/?languages=fr,de'),
+        ('ids', '/books/?ids=%s' % ','.join(
+            str(id) for id in random.sample(book_ids, min(book_count, 20))
+        )),
+        ('author_years', '/books/?author_year_start=1800&author_year_end=1899'),
+        ('mime_type', '/books/?mime_type=application%2Fx-mobipocket-ebook'),
+        ('ascending', '/books/?sort=ascending'),
+        ('deep_page', '/books/?page=%d' % max(deep_offset // page_size, 1)),
+    ]
+    if deep_position is not None:
+        urls.append((
+            'deep_cursor',
+            '/books/?cursor=%s' % encode_cursor(list(deep_position), False)
+        ))
+    return urls
+
+
+def get_latency_summary(times):
+    """ This gives percentiles and other figures of latencies in milliseconds. """
+
+    times = sorted(time * 1000 for time in times)
+
+    def get_percentile(percent):
+        index = max(round(percent / 100 * len(times)) - 1, 0)
+        return round(times[index], 3)
+
+    return {
+        'max': round(times[-1], 3),
+        'mean': round(sum(times) / len(times), 3),
+        'p50': get_percentile(50),
+        'p90': get_percentile(90),
+        'p99': get_percentile(99),
+    }
+
+
+def run_api_benchmarks(repeat=20, seed=0):
+    """
+    This times each request from `get_benchmark_urls` `repeat` times with an
+    empty cache and then `repeat` times with cached responses, counting the
+    queries that an uncached request makes.
+    """
+
+    client = Client()
+    results = {}
+    for name, url in get_benchmark_urls(seed):
+        query_counter = QueryCounter()
+        cache.clear()
+        with connection.execute_wrapper(query_counter):
+            response = client.get(url)
+
+        uncached_times = []
+        for _ in range(repeat):
+            cache.clear()
+            start_time = perf_counter()
+            client.get(url)
+            uncached_times.append(perf_counter() - start_time)
+
+        cached_times = []
+        for _ in range(repeat):
+            start_time = perf_counter()
+            client.get(url)
+            cached_times.append(perf_counter() - start_time)
+
+        results[name] = {
+            'bytes': len(response.content),
+            'cached_ms': get_latency_summary(cached_times),
+            'queries': query_counter.count,
+            'status': response.status_code,
+            'uncached_ms': get_latency_summary(uncached_times),
+            'url': url,
+        }
+    return results
@@ -0,0 +1,53 @@
+from hashlib import sha1
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import CatalogVersion
+
+
+CATALOG_VERSION_CACHE_KEY = 'books:catalog_version'
+
+
+def bump_catalog_version():
+    """ This records a new catalog version, which invalidates cached data. """
+
+    version = CatalogVersion.objects.create()
+    cache.delete(CATALOG_VERSION_CACHE_KEY)
+    return version
+
+
+def get_cache_key(prefix, parameters):
+    """
+    This makes a cache key for data about the current catalog version given
+    some canonical parameters (e.g. from `get_filter_parameters`).
+    """
+
+    encoded_parameters = json.dumps(parameters, sort_keys=True).encode('utf-8')
+    return 'books:%s:%d:%s' % (
+        prefix,
+        get_catalog_version().id,
+        sha1(encoded_parameters).hexdigest()
+    )
+
+
+def get_catalog_version():
+    """
+    This gives the latest catalog version, or an unsaved one with an ID of 0 if
+    no update has finished. It is cached briefly since every cached response
+    depends on it.
+    """
+
+    version = cache.get(CATALOG_VERSION_CACHE_KEY)
+    if version is None:
+        version = (
+            CatalogVersion.objects.order_by('-id').first()
+            or CatalogVersion(id=0, created=None)
+        )
+        cache.set(
+            CATALOG_VERSION_CACHE_KEY,
+            version,
+            settings.CATALOG_VERSION_CACHE_TIMEOUT
+        )
+    return version
@@ -0,0 +1,48 @@
+import gzip
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Brotli's default quality is much slower than gzip, so a middling one is used
+# for compressing responses as they are made.
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+
+ACCEPT_ENCODING_PATTERN = re.compile(r'^\s*([^\s;]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$')
+
+
+def compress(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content, quality=BROTLI_QUALITY)
+    return gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def get_accepted_encoding(accept_encoding):
+    """
+    This gives the best content encoding that an `Accept-Encoding` header
+    allows, preferring Brotli to gzip, or `None` if neither is allowed.
+    """
+
+    weights = {}
+    for value in accept_encoding.lower().split(','):
+        match = ACCEPT_ENCODING_PATTERN.match(value)
+        if match is None:
+            continue
+        try:
+            weights[match.group(1)] = float(match.group(2) or 1)
+        except ValueError:
+            continue
+
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best_encoding = None
+    best_weight = 0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get('*', 0))
+        if weight > best_weight:
+            best_encoding = encoding
+            best_weight = weight
+    return best_encoding
@@ -0,0 +1,62 @@
+from rest_framework.renderers import JSONRenderer
+
+from .models import Book, BookDocument
+from .serializers import BOOK_RELATIONS, BookSerializer
+
+
+CHUNK_SIZE = 1000
+
+
+def get_book_document_content(book):
+    """ This gives the JSON that the API gives for the book. """
+
+    return JSONRenderer().render(BookSerializer(book).data).decode('utf-8')
+
+
+def get_inconsistent_book_ids(books=None):
+    """
+    This gives the Project Gutenberg IDs of books whose documents are missing
+    or differ from what `BookSerializer` gives now.
+    """
+
+    inconsistent_ids = []
+    for book in iterate_books(books, with_documents=True):
+        try:
+            content = book.document.content
+        except BookDocument.DoesNotExist:
+            content = None
+        if content != get_book_document_content(book):
+            inconsistent_ids.append(book.gutenberg_id)
+    return inconsistent_ids
+
+
+def iterate_books(books=None, with_documents=False):
+    if books is None:
+        books = Book.objects.all()
+    books = books.order_by('id').prefetch_related(*BOOK_RELATIONS)
+    if with_documents:
+        books = books.select_related('document')
+    return books.iterator(chunk_size=CHUNK_SIZE)
+
+
+def update_book_documents(books=None):
+    """ This stores the API data of the given books (or all books). """
+
+    documents = []
+    for book in iterate_books(books):
+        documents.append(
+            BookDocument(book=book, content=get_book_document_content(book))
+        )
+        if len(documents) >= CHUNK_SIZE:
+            save_book_documents(documents)
+            documents = []
+    save_book_documents(documents)
+
+
+def save_book_documents(documents):
+    BookDocument.objects.bulk_create(
+        documents,
+        update_conflicts=True,
+        unique_fields=['book'],
+        update_fields=['content']
+    )
@@ -0,0 +1,138 @@
+from contextlib import redirect_stdout
+import json
+import os
+import platform
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import sys
+from unittest import mock
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import (
+    override_settings, setup_test_environment, teardown_test_environment
+)
+
+from books.benchmarks import (
+    QueryCounter, run_api_benchmarks, write_synthetic_catalog
+)
+from books.cache import bump_catalog_version
+from books.management.commands import updatecatalog
+
+
+DATABASE_NAME_PREFIX = 'benchmark_'
+
+# The benchmark clears the cache often, so it mustn't be one that's shared.
+BENCHMARK_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark',
+    },
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'This puts a synthetic catalog in a throwaway database and times the '
+        'import and common API requests, giving the results as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--books',
+            default=2000,
+            help='The number of books in the synthetic catalog.',
+            type=int
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the results to this file instead of standard output.'
+        )
+        parser.add_argument(
+            '--repeat',
+            default=20,
+            help='The number of times each API request is timed.',
+            type=int
+        )
+        parser.add_argument(
+            '--seed',
+            default=0,
+            help='The seed of the synthetic catalog and requests.',
+            type=int
+        )
+        parser.add_argument(
+            '--workers',
+            default=1,
+            help='The number of processes that parse RDF files.',
+            type=int
+        )
+
+    def handle(self, *args, **options):
+        database_name = connection.settings_dict['NAME']
+        test_settings = connection.settings_dict['TEST']
+        test_database_name = test_settings.get('NAME')
+        test_settings['NAME'] = DATABASE_NAME_PREFIX + database_name
+
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(CACHES=BENCHMARK_CACHES):
+                results = self.run_benchmarks(options)
+        finally:
+            connection.creation.destroy_test_db(database_name, verbosity=0)
+            teardown_test_environment()
+            test_settings['NAME'] = test_database_name
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def run_benchmarks(self, options):
+        book_count = options['books']
+        query_counter = QueryCounter()
+
+        with TemporaryDirectory() as catalog_path, \
+                TemporaryDirectory() as log_path:
+            write_synthetic_catalog(catalog_path, book_count, options['seed'])
+
+            # The import's progress goes to standard error to keep the
+            # results on standard output readable, and its log goes to a
+            # throwaway directory instead of the real catalog logs.
+            with override_settings(CATALOG_RDF_DIR=catalog_path), \
+                    mock.patch.object(updatecatalog, 'LOG_DIRECTORY', log_path), \
+                    mock.patch.object(
+                        updatecatalog,
+                        'LOG_PATH',
+                        os.path.join(log_path, updatecatalog.LOG_FILE_NAME)
+                    ), \
+                    redirect_stdout(sys.stderr), \
+                    connection.execute_wrapper(query_counter):
+                start_time = perf_counter()
+                updatecatalog.put_catalog_in_db(
+                    workers=options['workers'], full=True
+                )
+                import_time = perf_counter() - start_time
+        bump_catalog_version()
+
+        return {
+            'api': run_api_benchmarks(options['repeat'], options['seed']),
+            'environment': {
+                'django': django.get_version(),
+                'postgresql': connection.pg_version,
+                'python': platform.python_version(),
+            },
+            'import': {
+                'books': book_count,
+                'books_per_second': round(book_count / import_time, 1),
+                'queries': query_counter.count,
+                'seconds': round(import_time, 3),
+            },
+            'options': {
+                name: options[name]
+                for name in ('books', 'repeat', 'seed', 'workers')
+            },
+        }
@@ -0,0 +1,75 @@
+from io import BytesIO
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from books import utils
+from books.management.commands.updatecatalog import get_book_ids, get_book_path
+
+
+PARSERS = (
+    ('tree', utils.get_book),
+    ('events', utils.extract_book),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'This times the RDF parsers on files from the catalog directory, '
+        'checking that they give the same data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            default=1000,
+            help='The number of catalog files to parse.',
+            type=int
+        )
+        parser.add_argument(
+            '--repeat',
+            default=3,
+            help='The number of timed runs of each parser (the best is kept).',
+            type=int
+        )
+
+    def handle(self, *args, **options):
+        book_files = []
+        for id in get_book_ids()[:options['limit']]:
+            with open(get_book_path(id), 'rb') as file:
+                book_files.append((id, file.read()))
+        if not book_files:
+            raise CommandError(
+                'There are no RDF files in `%s`.' % settings.CATALOG_RDF_DIR
+            )
+
+        for id, contents in book_files:
+            tree_book = utils.get_book(id, BytesIO(contents))
+            tree_book['bookshelves'].sort()
+            if utils.extract_book(id, BytesIO(contents)) != tree_book:
+                raise CommandError('The parsers disagree about book %d.' % id)
+
+        best_times = {}
+        for name, get_book in PARSERS:
+            times = []
+            for _ in range(options['repeat']):
+                start_time = perf_counter()
+                for id, contents in book_files:
+                    get_book(id, BytesIO(contents))
+                times.append(perf_counter() - start_time)
+            best_times[name] = min(times)
+            self.stdout.write(
+                '%s: %.3f seconds for %d files (%.1f files per second)' % (
+                    name,
+                    best_times[name],
+                    len(book_files),
+                    len(book_files) / best_times[name]
+                )
+            )
+
+        self.stdout.write(
+            'The event parser is %.2f times as fast as the tree parser.' % (
+                best_times['tree'] / best_times['events']
+            )
+        )
@@ -0,0 +1,79 @@
+from time import process_time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+from books.models import Book
+from books.serializers import BOOK_RELATIONS, BookSerializer, FastBookSerializer
+
+
+SERIALIZERS = (
+    ('standard', BookSerializer),
+    ('fast', FastBookSerializer),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'This times the book serializers on pages of books from the database, '
+        'checking that they give the same JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pages',
+            default=20,
+            help='The number of pages of the most popular books to serialize.',
+            type=int
+        )
+        parser.add_argument(
+            '--repeat',
+            default=5,
+            help='The number of timed runs of each serializer (the best is kept).',
+            type=int
+        )
+
+    def handle(self, *args, **options):
+        page_size = api_settings.PAGE_SIZE
+        books = list(
+            Book.objects.order_by('-download_count', 'id')
+            .prefetch_related(*BOOK_RELATIONS)[:options['pages'] * page_size]
+        )
+        if not books:
+            raise CommandError('There are no books in the database.')
+        pages = [
+            books[start:start + page_size]
+            for start in range(0, len(books), page_size)
+        ]
+
+        renderer = JSONRenderer()
+        for book in books:
+            if (
+                renderer.render(FastBookSerializer(book).data) !=
+                renderer.render(BookSerializer(book).data)
+            ):
+                raise CommandError(
+                    'The serializers disagree about book %d.' % book.gutenberg_id
+                )
+
+        best_times = {}
+        for name, serializer_class in SERIALIZERS:
+            times = []
+            for _ in range(options['repeat']):
+                start_time = process_time()
+                for page in pages:
+                    serializer_class(page, many=True).data
+                times.append(process_time() - start_time)
+            best_times[name] = min(times)
+            self.stdout.write(
+                '%s: %.3f ms of CPU time per page of %d books' % (
+                    name, best_times[name] * 1000 / len(pages), page_size
+                )
+            )
+
+        self.stdout.write(
+            'The fast serializer is %.2f times as fast as the standard one.' % (
+                best_times['standard'] / best_times['fast']
+            )
+        )
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from books.documents import get_inconsistent_book_ids, update_book_documents
+from books.models import Book
+
+
+class Command(BaseCommand):
+    help = (
+        'This checks that stored book documents match what the API serializer '
+        'gives now.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Rewrite the documents of inconsistent books.'
+        )
+
+    def handle(self, *args, **options):
+        inconsistent_ids = get_inconsistent_book_ids()
+        if not inconsistent_ids:
+            self.stdout.write('All book documents are consistent.')
+            return
+
+        self.stdout.write(
+            '%d book documents are missing or stale: %s' % (
+                len(inconsistent_ids),
+                ', '.join(str(id) for id in inconsistent_ids)
+            )
+        )
+
+        if options['fix']:
+            update_book_documents(
+                Book.objects.filter(gutenberg_id__in=inconsistent_ids)
+            )
+            self.stdout.write('The documents have been rewritten.')
+        else:
+            raise CommandError('Book documents are inconsistent.')
@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Avg, Count, Max
+
+from books.models import SlowQuerySample
+from books.slowqueries import explain_slow_query_sample
+
+
+class Command(BaseCommand):
+    help = (
+        'This lists the parameter signatures of book requests with the '
+        'slowest sampled queries, worst first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete the samples after listing them.'
+        )
+        parser.add_argument(
+            '--limit',
+            default=10,
+            help='The number of signatures to list.',
+            type=int
+        )
+        parser.add_argument(
+            '--plans',
+            action='store_true',
+            help=(
+                'Show the SQL and plan of the slowest sample of each '
+                'signature, explaining it first if it has no plan yet.'
+            )
+        )
+
+    def handle(self, *args, **options):
+        signatures = SlowQuerySample.objects.values('signature').annotate(
+            average_duration=Avg('duration'),
+            max_duration=Max('duration'),
+            max_query_duration=Max('query_duration'),
+            sample_count=Count('id'),
+        ).order_by('-max_duration')[:options['limit']]
+
+        if not signatures:
+            self.stdout.write('There are no slow query samples.')
+
+        for signature in signatures:
+            self.stdout.write(
+                '%s: %d samples, %.1f ms at most (%.1f ms on average), '
+                'slowest query %.1f ms' % (
+                    signature['signature'],
+                    signature['sample_count'],
+                    signature['max_duration'],
+                    signature['average_duration'],
+                    signature['max_query_duration']
+                )
+            )
+            if options['plans']:
+                sample = SlowQuerySample.objects.filter(
+                    signature=signature['signature']
+                ).order_by('-duration').first()
+                if not sample.plan:
+                    explain_slow_query_sample(sample)
+                self.stdout.write('  ?%s' % sample.parameters)
+                self.stdout.write('  ' + sample.sql)
+                for line in sample.plan.splitlines():
+                    self.stdout.write('    ' + line)
+
+        if options['clear']:
+            SlowQuerySample.objects.all().delete()
+            self.stdout.write('The samples have been deleted.')
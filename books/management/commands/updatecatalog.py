@@ -1,17 +1,36 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from itertools import islice
 from subprocess import call
-import json
 import os
+import re
 import shutil
-from time import strftime
+import tarfile
+from time import strftime, time
 import sys
 import urllib.request
 
 from django.conf import settings
 from django.core.mail import send_mail
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.functions import Coalesce
 
 from books import utils
+from books.cache import bump_catalog_version
+from books.documents import update_book_documents
 from books.models import *
+from books.search import update_search_vectors
+from books.staging import (
+    create_staging_tables,
+    drop_staging_tables,
+    finish_staging_tables,
+    staging_tables_exist,
+    swap_staging_tables,
+    use_staging_tables,
+)
 
 
 TEMP_PATH = settings.CATALOG_TEMP_DIR
@@ -26,6 +45,27 @@ LOG_DIRECTORY = settings.CATALOG_LOG_DIR
 LOG_FILE_NAME = strftime('%Y-%m-%d_%H%M%S') + '.txt'
 LOG_PATH = os.path.join(LOG_DIRECTORY, LOG_FILE_NAME)
 
+# This matches the paths of RDF files in catalog archives, e.g.
+# `cache/epub/84/pg84.rdf`.
+ARCHIVE_RDF_PATTERN = re.compile(r'(?:^|/)(\d+)/pg\1\.rdf$')
+
+# This is how many books each parsing worker gets at a time.
+PARSE_CHUNK_SIZE = 64
+
+# This is how many books are put in the database in each transaction.
+IMPORT_CHUNK_SIZE = 500
+
+# This is the most IDs that each lookup cache keeps during an import.
+LOOKUP_CACHE_SIZE = 200000
+
+# These are the fields that identify objects shared between books.
+LOOKUP_FIELDS = {
+    Bookshelf: ('name',),
+    Language: ('code',),
+    Person: ('name', 'birth_year', 'death_year'),
+    Subject: ('name',),
+}
+
 
 # This gives a set of the names of the subdirectories in the given file path.
 def get_directory_set(path):
@@ -46,7 +86,9 @@ def log(*args):
         log_file.write(text)
 
 
-def put_catalog_in_db():
+def get_book_ids():
+    """ This gives the sorted IDs of the books in the catalog directory. """
+
     book_ids = []
     for directory_item in os.listdir(settings.CATALOG_RDF_DIR):
         item_path = os.path.join(settings.CATALOG_RDF_DIR, directory_item)
@@ -59,192 +101,592 @@ def put_catalog_in_db():
             else:
                 book_ids.append(book_id)
     book_ids.sort()
-    book_directories = [str(id) for id in book_ids]
+    return book_ids
 
-    for directory in book_directories:
-        id = int(directory)
 
-        if (id > 0) and (id % 500 == 0):
-            log('    %d' % id)
+def get_book_path(id):
+    return os.path.join(settings.CATALOG_RDF_DIR, str(id), 'pg%d.rdf' % id)
 
-        book_path = os.path.join(
-            settings.CATALOG_RDF_DIR,
-            directory,
-            'pg' + directory + '.rdf'
-        )
 
-        book = utils.get_book(id, book_path)
+def get_archive_files(archive_path):
+    """
+    This reads a compressed catalog archive as a stream, giving the book ID and
+    contents of each RDF file in it without extracting anything to disk.
+    """
 
-        try:
-            '''Make/update the book.'''
+    with tarfile.open(archive_path, mode='r|*') as archive:
+        for member in archive:
+            match = ARCHIVE_RDF_PATTERN.search(member.name)
+            if member.isfile() and match:
+                yield int(match.group(1)), archive.extractfile(member).read()
 
-            book_in_db = Book.objects.filter(gutenberg_id=id)
 
-            if book_in_db.exists():
-                book_in_db = book_in_db[0]
-                book_in_db.copyright = book['copyright']
-                book_in_db.download_count = book['downloads']
-                book_in_db.media_type = book['type']
-                book_in_db.title = book['title']
-                book_in_db.save()
-            else:
-                book_in_db = Book.objects.create(
-                    gutenberg_id=id,
-                    copyright=book['copyright'],
-                    download_count=book['downloads'],
-                    media_type=book['type'],
-                    title=book['title']
-                )
+def get_directory_files():
+    """ This gives the book ID and contents of each RDF file in the catalog. """
 
-            ''' Make/update the authors. '''
+    for id in get_book_ids():
+        with open(get_book_path(id), 'rb') as file:
+            yield id, file.read()
 
-            authors = []
-            for author in book['authors']:
-                person = get_or_create_person(author)
-                authors.append(person)
 
-            book_in_db.authors.clear()
-            for author in authors:
-                book_in_db.authors.add(author)
+def parse_books(book_files, workers=1):
+    """
+    This parses RDF files given as pairs of book IDs and contents, giving the
+    results in the same order. With more than one worker, files are parsed in
+    a process pool, with at most two batches of results waiting to be used at
+    a time. (The workers run `utils.parse_book`, since `utils` can be imported
+    without setting up Django, which processes that are spawned rather than
+    forked would need to do.)
+    """
 
-            ''' Make/update the editors. '''
+    if workers < 2:
+        for id, contents in book_files:
+            yield utils.parse_book(id, contents)
+        return
 
-            editors = []
-            for editor in book['editors']:
-                person = get_or_create_person(editor)
-                editors.append(person)
+    book_files = iter(book_files)
+    batch_size = workers * PARSE_CHUNK_SIZE * 4
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending_books = iter([])
+        while True:
+            batch = list(islice(book_files, batch_size))
+            if not batch:
+                break
+            next_books = executor.map(
+                utils.parse_book, *zip(*batch), chunksize=PARSE_CHUNK_SIZE
+            )
+            yield from pending_books
+            pending_books = next_books
+        yield from pending_books
 
-            book_in_db.editors.clear()
-            for editor in editors:
-                book_in_db.editors.add(editor)
 
-            ''' Make/update the translators. '''
+def get_catalog_checkpoint():
+    """
+    This gives the checkpoint of the unfinished import of the latest catalog,
+    if there is one.
+    """
 
-            translators = []
-            for translator in book['translators']:
-                person = get_or_create_person(translator)
-                translators.append(person)
+    return CatalogCheckpoint.objects.filter(
+        catalog_version=get_latest_catalog_version_id()
+    ).first()
 
-            book_in_db.translators.clear()
-            for translator in translators:
-                book_in_db.translators.add(translator)
 
-            ''' Make/update the book shelves. '''
+def get_latest_catalog_version_id():
+    return CatalogVersion.objects.aggregate(
+        id=Coalesce(Max('id'), 0)
+    )['id']
 
-            bookshelves = []
-            for shelf in book['bookshelves']:
-                shelf_in_db = Bookshelf.objects.filter(name=shelf)
-                if shelf_in_db.exists():
-                    shelf_in_db = shelf_in_db[0]
-                else:
-                    shelf_in_db = Bookshelf.objects.create(name=shelf)
-                bookshelves.append(shelf_in_db)
 
-            book_in_db.bookshelves.clear()
-            for bookshelf in bookshelves:
-                book_in_db.bookshelves.add(bookshelf)
+def put_catalog_in_db(workers=1, full=False, archive_path=None):
+    """
+    This puts books from the catalog directory, or from a catalog archive if
+    its path is given, in the database. Unless `full` is true, only books whose
+    RDF files are new or changed since they were last imported are parsed and
+    written. Books that aren't in the catalog anymore are removed.
 
-            ''' Make/update the formats. '''
+    Books are stored in chunks, each in a transaction that also records a
+    checkpoint, and an import that stops early resumes after the last stored
+    book the next time. Books that can't be parsed or stored are quarantined
+    instead of stopping the import.
+    """
 
-            old_formats = Format.objects.filter(book=book_in_db)
+    if archive_path is None:
+        expected_file_count = len(get_book_ids())
+    else:
+        expected_file_count = CatalogFile.objects.count()
 
-            format_ids = []
-            for format_ in book['formats']:
-                format_in_db = Format.objects.filter(
-                    book=book_in_db,
-                    mime_type=format_,
-                    url=book['formats'][format_]
+    if full:
+        old_digests = {}
+    else:
+        old_digests = dict(
+            CatalogFile.objects.values_list('gutenberg_id', 'digest')
+        )
+    catalog_book_ids = set()
+    digests = {}
+    positions = {}
+
+    catalog_version = get_latest_catalog_version_id()
+    checkpoint = get_catalog_checkpoint()
+    CatalogCheckpoint.objects.exclude(catalog_version=catalog_version).delete()
+    lookup_caches = get_lookup_caches()
+
+    def get_catalog_files():
+        if archive_path is None:
+            book_files = get_directory_files()
+        else:
+            book_files = get_archive_files(archive_path)
+        return enumerate(book_files, 1)
+
+    def get_changed_book_files():
+        book_files = get_catalog_files()
+
+        if checkpoint is not None:
+            log('    Resuming after book %d...' % checkpoint.gutenberg_id)
+            position = 0
+            for position, (id, _) in book_files:
+                catalog_book_ids.add(id)
+                if position == checkpoint.position:
+                    break
+            if position != checkpoint.position or id != checkpoint.gutenberg_id:
+                log(
+                    '    The checkpoint does not match the catalog, so every '
+                    'book will be checked.'
+                )
+                book_files = get_catalog_files()
+
+        for position, (id, contents) in book_files:
+            catalog_book_ids.add(id)
+            digest = utils.get_digest(contents)
+            if old_digests.get(id) != digest:
+                digests[id] = digest
+                positions[id] = position
+                yield id, contents
+
+    start_time = time()
+    start_position = checkpoint.position if checkpoint is not None else 0
+    parse_wait_time = 0
+    book_count = 0
+    quarantined_count = 0
+    books = parse_books(get_changed_book_files(), workers)
+
+    chunk = []
+    while True:
+        parse_start_time = time()
+        book = next(books, None)
+        parse_wait_time += time() - parse_start_time
+
+        if book is not None:
+            chunk.append(book)
+        if chunk and (book is None or len(chunk) == IMPORT_CHUNK_SIZE):
+            position = positions[chunk[-1]['id']]
+            quarantined_count += put_chunk_in_db(
+                chunk,
+                digests,
+                lookup_caches,
+                CatalogCheckpoint(
+                    id=1,
+                    catalog_version=catalog_version,
+                    gutenberg_id=chunk[-1]['id'],
+                    position=position
                 )
-                if format_in_db.exists():
-                    format_in_db = format_in_db[0]
-                else:
-                    format_in_db = Format.objects.create(
-                        book=book_in_db,
-                        mime_type=format_,
-                        url=book['formats'][format_]
-                    )
-                format_ids.append(format_in_db.id)
-
-            for old_format in old_formats:
-                if old_format.id not in format_ids:
-                    old_format.delete()
-
-            ''' Make/update the languages. '''
-
-            languages = []
-            for language in book['languages']:
-                language_in_db = Language.objects.filter(code=language)
-                if language_in_db.exists():
-                    language_in_db = language_in_db[0]
-                else:
-                    language_in_db = Language.objects.create(code=language)
-                languages.append(language_in_db)
-
-            book_in_db.languages.clear()
-            for language in languages:
-                book_in_db.languages.add(language)
-
-            ''' Make/update subjects. '''
-
-            subjects = []
-            for subject in book['subjects']:
-                subject_in_db = Subject.objects.filter(name=subject)
-                if subject_in_db.exists():
-                    subject_in_db = subject_in_db[0]
-                else:
-                    subject_in_db = Subject.objects.create(name=subject)
-                subjects.append(subject_in_db)
-
-            book_in_db.subjects.clear()
-            for subject in subjects:
-                book_in_db.subjects.add(subject)
-
-            ''' Make/update summaries. '''
-
-            old_summaries = Summary.objects.filter(book=book_in_db)
-
-            summary_ids = []
-            for summary in book['summaries']:
-                summary_in_db = Summary.objects.filter(book=book_in_db, text=summary)
-                if summary_in_db.exists():
-                    summary_in_db = summary_in_db[0]
-                else:
-                    summary_in_db = Summary.objects.create(
-                        book=book_in_db, text=summary
-                    ) 
-                summary_ids.append(summary_in_db.id)
-
-            for old_summary in old_summaries:
-                if old_summary.id not in summary_ids:
-                    old_summary.delete()
+            )
+            book_count += len(chunk)
+            log_progress(
+                chunk[-1]['id'],
+                book_count,
+                position - start_position,
+                max(expected_file_count - position, 0),
+                time() - start_time
+            )
+            for book in chunk:
+                del positions[book['id']]
+            chunk = []
+        if book is None:
+            break
+
+    total_time = time() - start_time
+    log(
+        '    Stored %d new or changed books of %d in %.1f seconds (%.1f books '
+        'per second, with %.1f seconds spent waiting for %d parsing '
+        'worker(s)).' % (
+            book_count - quarantined_count,
+            len(catalog_book_ids),
+            total_time,
+            book_count / total_time if total_time else 0,
+            parse_wait_time,
+            workers
+        )
+    )
+    log('    Lookup caches:')
+    for lookup_cache in lookup_caches.values():
+        log('      %s' % lookup_cache)
+
+    removed_book_ids = (
+        set(Book.objects.values_list('gutenberg_id', flat=True))
+        | set(CatalogFile.objects.values_list('gutenberg_id', flat=True))
+        | set(QuarantinedBook.objects.values_list('gutenberg_id', flat=True))
+    ) - catalog_book_ids
+    if removed_book_ids:
+        log('    Removing %d books no longer in the catalog...' % len(removed_book_ids))
+        delete_books_from_db(sorted(removed_book_ids))
+
+    CatalogCheckpoint.objects.all().delete()
+
+    quarantined_books = QuarantinedBook.objects.order_by('gutenberg_id')
+    if quarantined_books:
+        log('    %d books are quarantined:' % len(quarantined_books))
+        for quarantined_book in quarantined_books:
+            log('      %s' % quarantined_book)
+
+
+def log_progress(last_book_id, book_count, file_count, remaining_file_count,
+                 elapsed_time):
+    """
+    This logs how fast books are being stored, and roughly how long the rest of
+    the catalog will take at the current pace of reading RDF files.
+    """
+
+    if file_count and elapsed_time:
+        remaining_time = timedelta(
+            seconds=round(remaining_file_count * elapsed_time / file_count)
+        )
+    else:
+        remaining_time = 'unknown'
+    log(
+        '    Stored %d books through book %d (%.1f books per second); about '
+        '%s left' % (
+            book_count,
+            last_book_id,
+            book_count / elapsed_time if elapsed_time else 0,
+            remaining_time
+        )
+    )
 
-        except Exception as error:
-            book_json = json.dumps(book, indent=4)
-            log(
-                '  Error while putting this book info in the database:\n',
-                book_json,
-                '\n'
+
+def delete_books_from_db(book_ids):
+    with transaction.atomic():
+        for start in range(0, len(book_ids), IMPORT_CHUNK_SIZE):
+            chunk_ids = book_ids[start:start + IMPORT_CHUNK_SIZE]
+            Book.objects.filter(gutenberg_id__in=chunk_ids).delete()
+            CatalogFile.objects.filter(gutenberg_id__in=chunk_ids).delete()
+            QuarantinedBook.objects.filter(gutenberg_id__in=chunk_ids).delete()
+
+
+def put_chunk_in_db(chunk, digests, lookup_caches, checkpoint):
+    """
+    This puts a chunk of parsed books in the database and saves the given
+    checkpoint in one transaction. If the chunk can't be stored at once, its
+    books are stored one at a time, and ones that fail (or that couldn't be
+    parsed) are quarantined. This gives the number of quarantined books.
+    """
+
+    books = [book for book in chunk if 'error' not in book]
+    errors = {book['id']: book['error'] for book in chunk if 'error' in book}
+
+    with transaction.atomic():
+        try:
+            put_books_in_db(books, digests, lookup_caches)
+        except Exception:
+            for book in books:
+                try:
+                    put_books_in_db([book], digests, lookup_caches)
+                except Exception as error:
+                    errors[book['id']] = utils.get_error_message(error)
+
+        QuarantinedBook.objects.filter(
+            gutenberg_id__in=[book['id'] for book in chunk]
+        ).exclude(gutenberg_id__in=errors).delete()
+        QuarantinedBook.objects.bulk_create(
+            [
+                QuarantinedBook(error=error, gutenberg_id=id)
+                for id, error in sorted(errors.items())
+            ],
+            update_conflicts=True,
+            unique_fields=['gutenberg_id'],
+            update_fields=['error', 'updated']
+        )
+
+        checkpoint.save()
+
+    for id, error in sorted(errors.items()):
+        log('    Quarantined book %d (%s)' % (id, error))
+    return len(errors)
+
+
+def put_books_in_db(books, digests=None, lookup_caches=None):
+    """
+    This makes or updates the given parsed books and everything related to
+    them with a fixed number of queries, in one transaction. The digests of the
+    books' RDF files are recorded if they are given. Lookup caches (from
+    `get_lookup_caches`) can be given to share the IDs of objects like subjects
+    between calls.
+    """
+
+    if lookup_caches is None:
+        lookup_caches = get_lookup_caches(preload=False)
+
+    for lookup_cache in lookup_caches.values():
+        lookup_cache.begin()
+    try:
+        with transaction.atomic():
+            book_ids = put_book_rows_in_db(books)
+
+            for relation, book_key in (
+                (Book.authors, 'authors'),
+                (Book.editors, 'editors'),
+                (Book.translators, 'translators'),
+                (Book.bookshelves, 'bookshelves'),
+                (Book.languages, 'languages'),
+                (Book.subjects, 'subjects'),
+            ):
+                put_book_relations_in_db(
+                    books,
+                    book_ids,
+                    relation,
+                    lookup_caches[relation.rel.model],
+                    book_key
+                )
+
+            put_book_items_in_db(
+                books,
+                book_ids,
+                Format,
+                lambda book: book['formats'].items(),
+                ('mime_type', 'url')
+            )
+            put_book_items_in_db(
+                books,
+                book_ids,
+                Summary,
+                lambda book: [(summary,) for summary in book['summaries']],
+                ('text',)
             )
-            raise error
 
+            books_in_db = Book.objects.filter(id__in=book_ids.values())
+            update_search_vectors(books_in_db)
+            update_book_documents(books_in_db)
+
+            if digests is not None:
+                CatalogFile.objects.bulk_create(
+                    [
+                        CatalogFile(
+                            digest=digests[book['id']], gutenberg_id=book['id']
+                        )
+                        for book in books
+                    ],
+                    update_conflicts=True,
+                    unique_fields=['gutenberg_id'],
+                    update_fields=['digest']
+                )
+    except Exception as error:
+        # The IDs of objects made in the transaction aren't valid anymore.
+        for lookup_cache in lookup_caches.values():
+            lookup_cache.roll_back()
+        log(
+            '  Error while putting these books in the database:',
+            ', '.join(str(book['id']) for book in books)
+        )
+        raise error
+
+
+def put_book_rows_in_db(books):
+    """
+    This makes or updates the rows of the given books, giving a dictionary of
+    their database IDs by Project Gutenberg ID.
+    """
+
+    Book.objects.bulk_create(
+        [
+            Book(
+                gutenberg_id=book['id'],
+                copyright=book['copyright'],
+                download_count=book['downloads'],
+                media_type=book['type'],
+                title=book['title']
+            )
+            for book in books
+        ],
+        update_conflicts=True,
+        unique_fields=['gutenberg_id'],
+        update_fields=['copyright', 'download_count', 'media_type', 'title']
+    )
 
-def get_or_create_person(data):
-    person = Person.objects.filter(
-        name=data['name'],
-        birth_year=data['birth'],
-        death_year=data['death']
+    return dict(
+        Book.objects.filter(
+            gutenberg_id__in=[book['id'] for book in books]
+        ).values_list('gutenberg_id', 'id')
     )
 
-    if person.exists():
-        person = person[0]
-    else:
-        person = Person.objects.create(
-            name=data['name'],
-            birth_year=data['birth'],
-            death_year=data['death']
+
+def put_book_items_in_db(books, book_ids, model, get_values, fields):
+    """
+    This makes the given items (e.g. formats) of books that aren't in the
+    database yet, and deletes ones that the books no longer have.
+    """
+
+    new_keys = set()
+    for book in books:
+        for values in get_values(book):
+            new_keys.add((book_ids[book['id']],) + tuple(values))
+
+    stale_item_ids = []
+    old_items = model.objects.filter(
+        book_id__in=book_ids.values()
+    ).values_list('id', 'book_id', *fields)
+    for item_id, *key in old_items:
+        key = tuple(key)
+        if key in new_keys:
+            new_keys.remove(key)
+        else:
+            stale_item_ids.append(item_id)
+
+    model.objects.filter(id__in=stale_item_ids).delete()
+    model.objects.bulk_create([
+        model(book_id=key[0], **dict(zip(fields, key[1:])))
+        for key in sorted(new_keys)
+    ])
+
+
+def put_book_relations_in_db(books, book_ids, relation, lookup_cache, book_key):
+    """
+    This replaces the rows of a many-to-many relation (e.g. `Book.authors`) for
+    the given books, making any related objects that don't exist yet.
+    """
+
+    model = lookup_cache.model
+    lookup_keys = {
+        book['id']: [get_lookup_key(model, value) for value in book[book_key]]
+        for book in books
+    }
+    lookup_ids = lookup_cache.get_ids(
+        {key for keys in lookup_keys.values() for key in keys}
+    )
+
+    through = relation.through
+    target_field_name = relation.field.m2m_reverse_field_name()
+    through.objects.filter(book_id__in=book_ids.values()).delete()
+
+    through_rows = []
+    for book in books:
+        target_ids = []
+        for key in lookup_keys[book['id']]:
+            if lookup_ids[key] not in target_ids:
+                target_ids.append(lookup_ids[key])
+        for target_id in target_ids:
+            through_rows.append(through(**{
+                'book_id': book_ids[book['id']],
+                target_field_name + '_id': target_id,
+            }))
+    through.objects.bulk_create(through_rows)
+
+
+def get_lookup_caches(preload=True):
+    """
+    This makes a lookup cache for each model in `LOOKUP_FIELDS`, loading the
+    IDs of existing objects into them unless `preload` is false.
+    """
+
+    lookup_caches = {}
+    for model in LOOKUP_FIELDS:
+        lookup_caches[model] = LookupCache(model)
+        if preload:
+            lookup_caches[model].preload()
+    return lookup_caches
+
+
+def get_lookup_key(model, value):
+    """ This gives a lookup key (e.g. of a person) from parsed book data. """
+
+    if model is Person:
+        return (value['name'], value['birth'], value['death'])
+    return (value,)
+
+
+class LookupCache:
+    """
+    This remembers the IDs of objects shared between books (e.g. subjects) by
+    their lookup keys during an import, keeping up to `LOOKUP_CACHE_SIZE` of the
+    most recently used ones. Objects that aren't in the cache are looked up or
+    made in batches.
+    """
+
+    def __init__(self, model, size=None):
+        self.model = model
+        self.fields = LOOKUP_FIELDS[model]
+        self.size = LOOKUP_CACHE_SIZE if size is None else size
+        self.ids = OrderedDict()
+        self.new_keys = []
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self):
+        lookup_count = self.hits + self.misses
+        return '%s: %d hits and %d misses (%.1f%% hits), %d IDs kept' % (
+            self.model._meta.model_name,
+            self.hits,
+            self.misses,
+            100 * self.hits / lookup_count if lookup_count else 0,
+            len(self.ids)
+        )
+
+    def add(self, key, id):
+        self.ids[key] = id
+        self.ids.move_to_end(key)
+        while len(self.ids) > self.size:
+            self.ids.popitem(last=False)
+
+    def begin(self):
+        """ This starts keeping track of objects made in a new transaction. """
+
+        self.new_keys = []
+
+    def get_ids(self, keys):
+        """
+        This gives the IDs of the objects with the given keys, making any that
+        don't exist yet.
+        """
+
+        lookup_ids = {}
+        missing_keys = set()
+        for key in keys:
+            id = self.ids.get(key)
+            if id is None:
+                missing_keys.add(key)
+            else:
+                self.ids.move_to_end(key)
+                lookup_ids[key] = id
+        self.hits += len(lookup_ids)
+        self.misses += len(missing_keys)
+        if not missing_keys:
+            return lookup_ids
+
+        existing_ids = {}
+        existing_objects = self.model.objects.filter(**{
+            self.fields[0] + '__in': {key[0] for key in missing_keys}
+        }).order_by('-id').values_list('id', *self.fields)
+        for id, *key in existing_objects:
+            existing_ids[tuple(key)] = id
+
+        new_keys = sorted(
+            [key for key in missing_keys if key not in existing_ids],
+            key=lambda key: [(value is not None, value) for value in key]
         )
-    
-    return person
+        new_objects = self.model.objects.bulk_create([
+            self.model(**dict(zip(self.fields, key))) for key in new_keys
+        ])
+        for key, new_object in zip(new_keys, new_objects):
+            existing_ids[key] = new_object.id
+        self.new_keys += new_keys
+
+        for key in missing_keys:
+            lookup_ids[key] = existing_ids[key]
+            self.add(key, existing_ids[key])
+        return lookup_ids
+
+    def preload(self):
+        """
+        This loads the IDs of existing objects (the newest ones, if there are
+        more than the cache keeps) in one query.
+        """
+
+        existing_objects = self.model.objects.order_by('-id').values_list(
+            'id', *self.fields
+        )[:self.size]
+        ids = {}
+        for id, *key in existing_objects:
+            ids[tuple(key)] = id
+        for key, id in reversed(ids.items()):
+            self.add(key, id)
+
+    def roll_back(self):
+        """
+        This forgets the objects made since `begin` was called, after the
+        transaction that made them is rolled back.
+        """
+
+        for key in self.new_keys:
+            self.ids.pop(key, None)
+        self.new_keys = []
 
 
 def send_log_email():
@@ -294,68 +736,69 @@ def send_log_email():
 class Command(BaseCommand):
     help = 'This replaces the catalog files with the latest ones.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--archive',
+            help='Use this local catalog archive instead of downloading one.'
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Import every book, not just ones with new or changed files.'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Start over instead of resuming an unfinished import.'
+        )
+        parser.add_argument(
+            '--staged',
+            action='store_true',
+            help=(
+                'Build the new catalog in staging tables and swap them in once '
+                'it is complete, so that the API never sees a partial update.'
+            )
+        )
+        parser.add_argument(
+            '--stream',
+            action='store_true',
+            help=(
+                'Read RDF files straight from the archive instead of extracting '
+                'them to the catalog directory.'
+            )
+        )
+        parser.add_argument(
+            '--workers',
+            default=os.cpu_count() or 1,
+            help='The number of processes that parse RDF files.',
+            type=int
+        )
+
     def handle(self, *args, **options):
         try:
             date_and_time = strftime('%H:%M:%S on %B %d, %Y')
             log('Starting script at', date_and_time)
 
-            log('  Making temporary directory...')
-            if os.path.exists(TEMP_PATH):
-                raise CommandError(
-                    'The temporary path, `' + TEMP_PATH + '`, already exists.'
-                )
+            if options['staged']:
+                if options['restart']:
+                    log('  Dropping the staging tables...')
+                    drop_staging_tables()
+                log('  Preparing the staging tables...')
+                if not create_staging_tables():
+                    log('  Reusing the staging tables of the unfinished import...')
+                with use_staging_tables():
+                    self.update_catalog(options)
+
+                log('  Indexing and analyzing the staging tables...')
+                finish_staging_tables()
+
+                log('  Swapping in the staging tables...')
+                swap_staging_tables()
             else:
-                os.makedirs(TEMP_PATH)
+                self.update_catalog(options)
 
-            log('  Downloading compressed catalog...')
-            urllib.request.urlretrieve(URL, DOWNLOAD_PATH)
-
-            log('  Decompressing catalog...')
-            if not os.path.exists(DOWNLOAD_PATH):
-                os.makedirs(DOWNLOAD_PATH)
-            with open(os.devnull, 'w') as null:
-                call(
-                    ['tar', 'fjvx', DOWNLOAD_PATH, '-C', TEMP_PATH],
-                    stdout=null,
-                    stderr=null
-                )
-
-            log('  Detecting stale directories...')
-            if not os.path.exists(MOVE_TARGET_PATH):
-                os.makedirs(MOVE_TARGET_PATH)
-            new_directory_set = get_directory_set(MOVE_SOURCE_PATH)
-            old_directory_set = get_directory_set(MOVE_TARGET_PATH)
-            stale_directory_set = old_directory_set - new_directory_set
-
-            log('  Removing stale directories and books...')
-            for directory in stale_directory_set:
-                try:
-                    book_id = int(directory)
-                except ValueError:
-                    # Ignore the directory if its name isn't a book ID number.
-                    continue
-                book = Book.objects.filter(gutenberg_id=book_id)
-                book.delete()
-                path = os.path.join(MOVE_TARGET_PATH, directory)
-                shutil.rmtree(path)
-
-            log('  Replacing old catalog files...')
-            with open(os.devnull, 'w') as null:
-                with open(LOG_PATH, 'a') as log_file:
-                    call(
-                        [
-                            'rsync',
-                            '-va',
-                            '--delete-after',
-                            MOVE_SOURCE_PATH + '/',
-                            MOVE_TARGET_PATH
-                        ],
-                        stdout=null,
-                        stderr=log_file
-                    )
-
-            log('  Putting the catalog in the database...')
-            put_catalog_in_db()
+            log('  Recording the catalog version...')
+            bump_catalog_version()
 
             log('  Removing temporary files...')
             shutil.rmtree(TEMP_PATH)
@@ -364,7 +807,110 @@ class Command(BaseCommand):
         except Exception as error:
             error_message = str(error)
             log('Error:', error_message)
+            checkpoint = self.get_catalog_checkpoint(options)
+            if checkpoint is None:
+                shutil.rmtree(TEMP_PATH)
+            else:
+                log(
+                    'Running this again will resume the import after book',
+                    str(checkpoint.gutenberg_id)
+                )
             log('')
-            shutil.rmtree(TEMP_PATH)
 
         send_log_email()
+
+    def get_catalog_checkpoint(self, options):
+        if not options['staged']:
+            return get_catalog_checkpoint()
+        if not staging_tables_exist():
+            return None
+        with use_staging_tables():
+            return get_catalog_checkpoint()
+
+    def update_catalog(self, options):
+        checkpoint = get_catalog_checkpoint()
+        if checkpoint is not None and options['restart']:
+            log('  Discarding the checkpoint of the unfinished import...')
+            CatalogCheckpoint.objects.all().delete()
+            checkpoint = None
+        if options['restart'] and os.path.exists(TEMP_PATH):
+            log('  Discarding the temporary files of the unfinished import...')
+            shutil.rmtree(TEMP_PATH)
+
+        log('  Making temporary directory...')
+        if os.path.exists(TEMP_PATH):
+            if checkpoint is None:
+                raise CommandError(
+                    'The temporary path, `' + TEMP_PATH + '`, already exists.'
+                )
+            log('  Reusing the temporary files of the unfinished import...')
+        else:
+            os.makedirs(TEMP_PATH)
+
+        archive_path = options['archive']
+        if archive_path is None:
+            archive_path = DOWNLOAD_PATH
+            if checkpoint is None or not os.path.exists(DOWNLOAD_PATH):
+                log('  Downloading compressed catalog...')
+                urllib.request.urlretrieve(URL, DOWNLOAD_PATH)
+
+        if options['stream']:
+            log('  Putting the catalog in the database from the archive...')
+            put_catalog_in_db(
+                workers=options['workers'],
+                full=options['full'],
+                archive_path=archive_path
+            )
+        else:
+            self.replace_catalog_files(archive_path)
+
+            log('  Putting the catalog in the database...')
+            put_catalog_in_db(workers=options['workers'], full=options['full'])
+
+    def replace_catalog_files(self, archive_path):
+        if os.path.exists(MOVE_SOURCE_PATH):
+            log('  Using the catalog that was already decompressed...')
+        else:
+            log('  Decompressing catalog...')
+            if not os.path.exists(archive_path):
+                os.makedirs(archive_path)
+            with open(os.devnull, 'w') as null:
+                call(
+                    ['tar', 'fjvx', archive_path, '-C', TEMP_PATH],
+                    stdout=null,
+                    stderr=null
+                )
+
+        log('  Detecting stale directories...')
+        if not os.path.exists(MOVE_TARGET_PATH):
+            os.makedirs(MOVE_TARGET_PATH)
+        new_directory_set = get_directory_set(MOVE_SOURCE_PATH)
+        old_directory_set = get_directory_set(MOVE_TARGET_PATH)
+        stale_directory_set = old_directory_set - new_directory_set
+
+        log('  Removing stale directories and books...')
+        for directory in stale_directory_set:
+            try:
+                book_id = int(directory)
+            except ValueError:
+                # Ignore the directory if its name isn't a book ID number.
+                continue
+            book = Book.objects.filter(gutenberg_id=book_id)
+            book.delete()
+            path = os.path.join(MOVE_TARGET_PATH, directory)
+            shutil.rmtree(path)
+
+        log('  Replacing old catalog files...')
+        with open(os.devnull, 'w') as null:
+            with open(LOG_PATH, 'a') as log_file:
+                call(
+                    [
+                        'rsync',
+                        '-va',
+                        '--delete-after',
+                        MOVE_SOURCE_PATH + '/',
+                        MOVE_TARGET_PATH
+                    ],
+                    stdout=null,
+                    stderr=log_file
+                )
@@ -0,0 +1,174 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+
+from .parameters import get_filter_parameters
+
+
+DURATION_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """
+    This counts observed values in buckets for each set of labels, like a
+    Prometheus histogram. Values are kept in memory for the process, so each
+    server process gives its own numbers.
+    """
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.lock = Lock()
+        self.series = {}
+
+    def get_lines(self):
+        """ This gives lines of the Prometheus text format for the histogram. """
+
+        lines = [
+            '# HELP %s %s' % (self.name, self.description),
+            '# TYPE %s histogram' % self.name,
+        ]
+        with self.lock:
+            series = sorted(
+                (labels, list(counts), total, count)
+                for labels, (counts, total, count) in self.series.items()
+            )
+
+        for labels, counts, total, count in series:
+            label_text = ','.join(
+                '%s="%s"' % (name, escape_label_value(value))
+                for name, value in labels
+            )
+            cumulative_count = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative_count += bucket_count
+                lines.append('%s_bucket{%s,le="%s"} %d' % (
+                    self.name, label_text, bucket, cumulative_count
+                ))
+            lines.append(
+                '%s_bucket{%s,le="+Inf"} %d' % (self.name, label_text, count)
+            )
+            lines.append('%s_sum{%s} %s' % (self.name, label_text, repr(total)))
+            lines.append('%s_count{%s} %d' % (self.name, label_text, count))
+        return lines
+
+    def observe(self, labels, value):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0, 0]
+            bucket_index = bisect_left(self.buckets, value)
+            if bucket_index < len(self.buckets):
+                series[0][bucket_index] += 1
+            series[1] += value
+            series[2] += 1
+
+
+REQUEST_DURATION = Histogram(
+    'gutendex_request_duration_seconds',
+    'The time taken to respond to requests.',
+    DURATION_BUCKETS
+)
+REQUEST_DB_DURATION = Histogram(
+    'gutendex_request_db_duration_seconds',
+    'The time that requests spent on database queries.',
+    DURATION_BUCKETS
+)
+REQUEST_DB_QUERIES = Histogram(
+    'gutendex_request_db_queries',
+    'The number of database queries that requests made.',
+    QUERY_COUNT_BUCKETS
+)
+REQUEST_SERIALIZATION_DURATION = Histogram(
+    'gutendex_request_serialization_duration_seconds',
+    'The time that requests spent serializing and rendering data.',
+    DURATION_BUCKETS
+)
+HISTOGRAMS = (
+    REQUEST_DURATION,
+    REQUEST_DB_DURATION,
+    REQUEST_DB_QUERIES,
+    REQUEST_SERIALIZATION_DURATION,
+)
+
+
+class RequestMetrics:
+    """
+    This measures the database queries and serialization of a request. It is
+    installed as a database execute wrapper while the request is handled.
+    """
+
+    def __init__(self):
+        self.db_time = 0
+        self.query_count = 0
+        self.serialization_time = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start_time = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += perf_counter() - start_time
+            self.query_count += 1
+
+    def get_server_timing(self, total_time):
+        """ This gives the value of a `Server-Timing` header in milliseconds. """
+
+        return (
+            'db;dur=%.3f;desc="%d queries", serialization;dur=%.3f, '
+            'total;dur=%.3f' % (
+                self.db_time * 1000,
+                self.query_count,
+                self.serialization_time * 1000,
+                total_time * 1000
+            )
+        )
+
+    def record(self, request, response, total_time):
+        """ This adds the request's numbers to the histograms. """
+
+        resolver_match = request.resolver_match
+        labels = {
+            'filters': ','.join(sorted(get_filter_parameters(request.GET))) or 'none',
+            'status': str(response.status_code),
+            'view': resolver_match.view_name if resolver_match else 'none',
+        }
+        REQUEST_DURATION.observe(labels, total_time)
+        REQUEST_DB_DURATION.observe(labels, self.db_time)
+        REQUEST_DB_QUERIES.observe(labels, self.query_count)
+        REQUEST_SERIALIZATION_DURATION.observe(labels, self.serialization_time)
+
+
+def escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def get_metrics_text():
+    """ This gives all of the histograms in the Prometheus text format. """
+
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.get_lines()
+    return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def measure_serialization(request):
+    """
+    This adds the time taken in the context to the serialization time of the
+    request, if its metrics are being recorded.
+    """
+
+    metrics = getattr(request, 'metrics', None)
+    start_time = perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.serialization_time += perf_counter() - start_time
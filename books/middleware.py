@@ -0,0 +1,125 @@
+from contextlib import ExitStack, contextmanager
+from time import perf_counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+
+from .compression import compress, get_accepted_encoding
+from .metrics import RequestMetrics
+
+
+class CompressionMiddleware:
+    """
+    This compresses responses of at least `COMPRESSION_MIN_SIZE` bytes with
+    Brotli or gzip, whichever the client accepts. If a view sets a response's
+    `compressed_content_cache_key`, the compressed content is cached with that
+    key (and the encoding) so that it is compressed only once.
+    """
+
+    def __init__(self, get_response):
+        if not settings.RESPONSE_COMPRESSION:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (
+            response.streaming or
+            response.has_header('Content-Encoding') or
+            len(response.content) < settings.COMPRESSION_MIN_SIZE
+        ):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = get_accepted_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')
+        )
+        if encoding is None:
+            return response
+
+        cache_key = getattr(response, 'compressed_content_cache_key', None)
+        if cache_key is None:
+            content = compress(response.content, encoding)
+        else:
+            cache_key += ':' + encoding
+            content = cache.get(cache_key)
+            if content is None:
+                content = compress(response.content, encoding)
+                cache.set(
+                    cache_key, content, settings.BOOK_RESPONSE_CACHE_TIMEOUT
+                )
+        if len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        response['Content-Encoding'] = encoding
+        # The compressed content differs byte for byte, so a strong ETag
+        # becomes a weak one.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
+
+
+class RequestMetricsMiddleware:
+    """
+    This measures the database queries, serialization and total time of each
+    request, giving them in a `Server-Timing` header and adding them to the
+    histograms of the metrics endpoint. Streaming responses have no header,
+    since most of their work happens after headers are sent, and are added to
+    the histograms once they have been streamed.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start_time = perf_counter()
+        metrics = request.metrics = RequestMetrics()
+        with measure_queries(metrics):
+            response = self.get_response(request)
+
+        if response.streaming:
+            response.streaming_content = self.measure_streaming_content(
+                request, response, response.streaming_content, start_time
+            )
+            return response
+
+        total_time = perf_counter() - start_time
+        response['Server-Timing'] = metrics.get_server_timing(total_time)
+        metrics.record(request, response, total_time)
+        return response
+
+    def measure_streaming_content(self, request, response, content, start_time):
+        metrics = request.metrics
+        try:
+            with measure_queries(metrics):
+                yield from content
+        finally:
+            metrics.record(request, response, perf_counter() - start_time)
+
+    def process_template_response(self, request, response):
+        render_start_time = perf_counter()
+
+        def stop_serialization_timer(response):
+            metrics.serialization_time += perf_counter() - render_start_time
+
+        metrics = request.metrics
+        response.add_post_render_callback(stop_serialization_timer)
+        return response
+
+
+@contextmanager
+def measure_queries(metrics):
+    """ This installs `metrics` on every database connection in the context. """
+
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(metrics))
+        yield
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:54
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+FILL_SEARCH_VECTORS = '''
+UPDATE books_book SET search_vector =
+    setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce((
+        SELECT string_agg(books_person.name, ' ')
+        FROM books_book_authors
+        JOIN books_person ON books_person.id = books_book_authors.person_id
+        WHERE books_book_authors.book_id = books_book.id
+    ), '')), 'B')
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_book_editors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(null=True),
+        ),
+        migrations.RunSQL(FILL_SEARCH_VECTORS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_catalogversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookDocument',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='document', serialize=False, to='books.book')),
+                ('content', models.TextField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0010_bookdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64)),
+                ('gutenberg_id', models.PositiveIntegerField(unique=True)),
+            ],
+        ),
+    ]
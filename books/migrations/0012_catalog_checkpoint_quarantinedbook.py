@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0011_catalogfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('catalog_version', models.PositiveIntegerField()),
+                ('gutenberg_id', models.PositiveIntegerField()),
+                ('position', models.PositiveIntegerField()),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='QuarantinedBook',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('error', models.TextField()),
+                ('gutenberg_id', models.PositiveIntegerField(unique=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
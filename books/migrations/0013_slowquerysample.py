@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0012_catalog_checkpoint_quarantinedbook'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuerySample',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('duration', models.FloatField()),
+                ('parameters', models.TextField()),
+                ('plan', models.TextField(blank=True)),
+                ('query_duration', models.FloatField()),
+                ('signature', models.CharField(db_index=True, max_length=256)),
+                ('sql', models.TextField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:44
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+FILL_SEARCH_TEXTS = '''
+UPDATE books_book SET search_text =
+    coalesce(title, '') || E'\\n' || coalesce((
+        SELECT string_agg(books_person.name, E'\\n')
+        FROM books_book_authors
+        JOIN books_person ON books_person.id = books_book_authors.person_id
+        WHERE books_book_authors.book_id = books_book.id
+    ), '')
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0013_slowquerysample'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_text',
+            field=models.TextField(null=True),
+        ),
+        migrations.RunSQL(FILL_SEARCH_TEXTS, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('search_text'), name='gin_trgm_ops'), name='books_book_search_text_trgm'),
+        ),
+    ]
@@ -1,4 +1,19 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Upper
+
+
+def get_trigram_index(field_name, index_name):
+    """
+    This makes a trigram index for case-insensitive substring filters (e.g.
+    `icontains`), which Django compares with `UPPER(...) LIKE UPPER(...)`.
+    """
+
+    return GinIndex(
+        OpClass(Upper(field_name), name='gin_trgm_ops'),
+        name=index_name
+    )
 
 
 class Book(models.Model):
@@ -10,11 +25,24 @@ class Book(models.Model):
     gutenberg_id = models.PositiveIntegerField(unique=True)
     languages = models.ManyToManyField('Language')
     media_type = models.CharField(max_length=16)
+    search_text = models.TextField(null=True)
+    search_vector = SearchVectorField(null=True)
     subjects = models.ManyToManyField('Subject')
     title = models.CharField(blank=True, max_length=1024, null=True)
     translators = models.ManyToManyField(
         'Person', related_name='books_translated')
 
+    class Meta:
+        indexes = [
+            # This serves keyset pagination in popularity order.
+            models.Index(
+                fields=['download_count', 'id'],
+                name='books_book_popular_idx'
+            ),
+            get_trigram_index('search_text', 'books_book_search_text_trgm'),
+            get_trigram_index('title', 'books_book_title_trgm'),
+        ]
+
     def __str__(self):
         if self.title:
             return self.title
@@ -22,22 +50,77 @@ class Book(models.Model):
             return str(self.id)
 
     def get_formats(self):
-        return Format.objects.filter(book_id=self.id)
+        # This uses `format_set` so that prefetched formats are reused.
+        return self.format_set.all()
 
     def get_summaries(self):
-        return Summary.objects.filter(book_id=self.id)
+        # This uses `summary_set` so that prefetched summaries are reused.
+        return self.summary_set.all()
+
+
+class BookDocument(models.Model):
+    """ This stores the API data of a book as JSON, ready to be served. """
+
+    book = models.OneToOneField(
+        'Book',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='document'
+    )
+    content = models.TextField()
+
+    def __str__(self):
+        return self.book.__str__()
 
 
 class Bookshelf(models.Model):
     name = models.CharField(max_length=64, unique=True)
 
+    class Meta:
+        indexes = [get_trigram_index('name', 'books_bookshelf_name_trgm')]
+
     def __str__(self):
         return self.name
 
 
+class CatalogCheckpoint(models.Model):
+    """
+    This records how far an unfinished catalog import got, so that it can
+    resume after the last book that it stored.
+    """
+
+    catalog_version = models.PositiveIntegerField()
+    gutenberg_id = models.PositiveIntegerField()
+    position = models.PositiveIntegerField()
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '%d (%d)' % (self.gutenberg_id, self.position)
+
+
+class CatalogFile(models.Model):
+    """ This records the digest of the RDF file that a book was imported from. """
+
+    digest = models.CharField(max_length=64)
+    gutenberg_id = models.PositiveIntegerField(unique=True)
+
+    def __str__(self):
+        return 'pg%d.rdf (%s)' % (self.gutenberg_id, self.digest)
+
+
+class CatalogVersion(models.Model):
+    """ This records a finished catalog update. """
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '%d (%s)' % (self.id, self.created)
+
+
 class Format(models.Model):
     book = models.ForeignKey('Book', on_delete=models.CASCADE)
-    mime_type = models.CharField(max_length=32)
+    # The index supports `startswith` lookups.
+    mime_type = models.CharField(db_index=True, max_length=32)
     url = models.CharField(max_length=256)
 
     def __str__(self):
@@ -59,13 +142,48 @@ class Person(models.Model):
     death_year = models.SmallIntegerField(blank=True, null=True)
     name = models.CharField(max_length=128)
 
+    class Meta:
+        indexes = [get_trigram_index('name', 'books_person_name_trgm')]
+
     def __str__(self):
         return self.name
 
 
+class QuarantinedBook(models.Model):
+    """ This records a book that couldn't be imported from the catalog. """
+
+    error = models.TextField()
+    gutenberg_id = models.PositiveIntegerField(unique=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '%d: %s' % (self.gutenberg_id, self.error)
+
+
+class SlowQuerySample(models.Model):
+    """
+    This records the slowest query of a slow book request and, once it has
+    been explained, the query planner's account of running it.
+    """
+
+    created = models.DateTimeField(auto_now_add=True)
+    duration = models.FloatField()
+    parameters = models.TextField()
+    plan = models.TextField(blank=True)
+    query_duration = models.FloatField()
+    signature = models.CharField(db_index=True, max_length=256)
+    sql = models.TextField()
+
+    def __str__(self):
+        return '%s (%.1f ms)' % (self.signature, self.duration)
+
+
 class Subject(models.Model):
     name = models.CharField(max_length=256)
 
+    class Meta:
+        indexes = [get_trigram_index('name', 'books_subject_name_trgm')]
+
     def __str__(self):
         return self.name
 
@@ -0,0 +1,227 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import binascii
+from functools import partial
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .cache import get_cache_key
+from .parameters import get_filter_parameters
+
+
+class BookKeysetPagination(pagination.BasePagination):
+    """
+    This paginates books by their position in the sort order instead of by
+    page number, so deep pages are as fast as the first one and no count query
+    is needed.
+    """
+
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    page_size = api_settings.PAGE_SIZE
+
+    # These end with unique fields so that every book has its own position.
+    orderings = {
+        'ascending': ('id',),
+        'descending': ('-id',),
+        'popular': ('-download_count', '-id'),
+    }
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(request)
+        position, reverse = self.decode_cursor(request)
+
+        if reverse:
+            queryset = queryset.order_by(*[
+                get_reversed_field(field) for field in self.ordering
+            ])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if position is not None:
+            queryset = queryset.filter(
+                get_position_filter(self.ordering, position, reverse)
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not (self.has_next and self.page):
+            return None
+        return self.get_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not (self.has_previous and self.page):
+            return None
+        return self.get_link(self.page[0], reverse=True)
+
+    def get_link(self, book, reverse):
+        position = [
+            getattr(book, field.lstrip('-')) for field in self.ordering
+        ]
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, 'page')
+        return replace_query_param(
+            url,
+            self.cursor_query_param,
+            encode_cursor(position, reverse)
+        )
+
+    def get_ordering(self, request):
+        sort = request.query_params.get('sort')
+        return self.orderings.get(sort, self.orderings['popular'])
+
+    def decode_cursor(self, request):
+        """ This gives the position and direction in the request's cursor. """
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            position = cursor['p']
+            reverse = bool(cursor['r'])
+        except (binascii.Error, KeyError, TypeError, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if (
+            not isinstance(position, list)
+            or len(position) != len(self.ordering)
+            or not all(isinstance(value, int) for value in position)
+        ):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, reverse
+
+
+class BookPaginator(Paginator):
+    """ This caches the number of books under the given key. """
+
+    def __init__(self, *args, count_cache_key=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_cache_key = count_cache_key
+
+    @cached_property
+    def count(self):
+        if self.count_cache_key is None:
+            return get_book_count(self.object_list)
+
+        count = cache.get(self.count_cache_key)
+        if count is None:
+            count = get_book_count(self.object_list)
+            cache.set(
+                self.count_cache_key,
+                count,
+                settings.BOOK_COUNT_CACHE_TIMEOUT
+            )
+        return count
+
+
+class BookPagination(pagination.PageNumberPagination):
+    """
+    This paginates by page number by default, or by keyset when the request has
+    a `cursor` parameter (which is empty for the first page).
+    """
+
+    keyset_pagination_class = BookKeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.keyset_pagination_class.cursor_query_param in request.query_params:
+            self.keyset_paginator = self.keyset_pagination_class()
+            return self.keyset_paginator.paginate_queryset(
+                queryset, request, view
+            )
+
+        self.keyset_paginator = None
+        self.django_paginator_class = partial(
+            BookPaginator,
+            count_cache_key=get_cache_key(
+                'count', get_filter_parameters(request.query_params)
+            )
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset_paginator is not None:
+            return self.keyset_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+def encode_cursor(position, reverse):
+    cursor = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+    return urlsafe_b64encode(cursor.encode('ascii')).decode('ascii')
+
+
+def get_book_count(queryset):
+    """
+    This counts the books in the queryset, or uses the query planner's estimate
+    if that is at least `BOOK_COUNT_ESTIMATE_THRESHOLD` (when that is set).
+    """
+
+    threshold = settings.BOOK_COUNT_ESTIMATE_THRESHOLD
+    if threshold:
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        estimate = int(plan[0]['Plan']['Plan Rows'])
+        if estimate >= threshold:
+            return estimate
+
+    return queryset.count()
+
+
+def get_position_filter(ordering, position, reverse=False):
+    """
+    This filters books coming after the given position in the ordering (or
+    before it, if `reverse` is true).
+    """
+
+    position_filter = Q()
+    equal_fields = {}
+    for field, value in zip(ordering, position):
+        name = field.lstrip('-')
+        descending = field.startswith('-')
+        lookup = '%s__%s' % (name, 'lt' if descending != reverse else 'gt')
+        position_filter |= Q(**equal_fields, **{lookup: value})
+        equal_fields[name] = value
+
+    # The database can't start an index scan from the alternatives above, so a
+    # bound on the first field alone lets it skip the books before the position.
+    name = ordering[0].lstrip('-')
+    descending = ordering[0].startswith('-')
+    lookup = '%s__%s' % (name, 'lte' if descending != reverse else 'gte')
+    return Q(**{lookup: position[0]}) & position_filter
+
+
+def get_reversed_field(field):
+    return field[1:] if field.startswith('-') else '-' + field
@@ -0,0 +1,90 @@
+SEARCH_TERM_LIMIT = 32
+SORT_ORDERS = ('ascending', 'descending', 'popular', 'relevance')
+
+
+def get_filter_parameters(query_params):
+    """
+    This gives the book-list filter parameters in a canonical form, leaving out
+    ones that would be ignored, so that equivalent requests give equal values.
+    """
+
+    parameters = {}
+
+    for name in ('author_year_end', 'author_year_start'):
+        try:
+            parameters[name] = int(query_params.get(name))
+        except (TypeError, ValueError):
+            pass
+
+    copyright_parameter = query_params.get('copyright')
+    if copyright_parameter is not None:
+        copyright_strings = set(copyright_parameter.split(','))
+        parameters['copyright'] = sorted(
+            copyright_strings & {'false', 'null', 'true'}
+        )
+
+    id_string = query_params.get('ids')
+    if id_string is not None:
+        try:
+            parameters['ids'] = sorted({int(id) for id in id_string.split(',')})
+        except ValueError:
+            pass
+
+    language_string = query_params.get('languages')
+    if language_string is not None:
+        parameters['languages'] = sorted(
+            {code.lower() for code in language_string.split(',')}
+        )
+
+    mime_type = query_params.get('mime_type')
+    if mime_type is not None:
+        parameters['mime_type'] = mime_type
+
+    search_string = query_params.get('search')
+    if search_string is not None:
+        search_terms = [
+            term for term in search_string.split(' ')[:SEARCH_TERM_LIMIT] if term
+        ]
+        if search_terms:
+            parameters['search'] = search_terms
+
+    topic = query_params.get('topic')
+    if topic is not None:
+        parameters['topic'] = topic
+
+    return parameters
+
+
+def get_fields_parameter(query_params, field_names):
+    """
+    This gives the names in `field_names` that the `fields` and `omit`
+    parameters select, in their original order, or `None` if every field is
+    selected.
+    """
+
+    selected_names = field_names
+    fields_string = query_params.get('fields')
+    if fields_string is not None:
+        requested_names = set(fields_string.split(','))
+        if requested_names & set(field_names):
+            selected_names = [
+                name for name in field_names if name in requested_names
+            ]
+
+    omit_string = query_params.get('omit')
+    if omit_string is not None:
+        omitted_names = set(omit_string.split(','))
+        selected_names = [
+            name for name in selected_names if name not in omitted_names
+        ]
+
+    if len(selected_names) == len(field_names):
+        return None
+    return list(selected_names)
+
+
+def get_sort_parameter(query_params):
+    """ This gives the requested sort order, which is `popular` by default. """
+
+    sort = query_params.get('sort')
+    return sort if sort in SORT_ORDERS else 'popular'
@@ -0,0 +1,104 @@
+import json
+import re
+from secrets import token_hex
+
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONFragment:
+    """
+    This is JSON text (e.g. a stored book document) that `BookJSONRenderer`
+    puts in its output as it is, rather than decoding and encoding it again.
+    """
+
+    def __init__(self, content):
+        self.content = content
+
+
+class FragmentJSONEncoder(JSONEncoder):
+    """ This decodes fragments for renderers that can't include them as they are. """
+
+    def default(self, obj):
+        if isinstance(obj, JSONFragment):
+            return json.loads(obj.content)
+        return super().default(obj)
+
+
+class BookJSONRenderer(JSONRenderer):
+    """
+    This renders JSON with orjson if it is installed, giving the same output as
+    `JSONRenderer` faster, and with `JSONFragment`s spliced in as they are. It
+    falls back to `JSONRenderer` without orjson or for indented output.
+    """
+
+    encoder_class = FragmentJSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None or
+            data is None or
+            self.ensure_ascii or
+            not self.compact or
+            self.get_indent(accepted_media_type, renderer_context or {})
+            is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        return render_with_orjson(data)
+
+
+class NDJSONRenderer(BookJSONRenderer):
+    """
+    This renders data as one line of newline-delimited JSON, which is never
+    indented.
+    """
+
+    format = 'ndjson'
+    media_type = 'application/x-ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return super().render(data) + b'\n'
+
+
+def render_with_orjson(data):
+    """
+    This encodes data like `JSONRenderer`, using orjson. Older versions of
+    orjson have no `Fragment` type, so fragments are encoded as unique strings
+    that are replaced with their JSON afterwards.
+    """
+
+    fallback_encoder = JSONEncoder()
+    fragments = []
+    placeholder_prefix = 'json-fragment-%s-' % token_hex(16)
+
+    def default(obj):
+        if isinstance(obj, JSONFragment):
+            if hasattr(orjson, 'Fragment'):
+                return orjson.Fragment(obj.content)
+            fragments.append(obj.content.encode('utf-8'))
+            return placeholder_prefix + str(len(fragments) - 1)
+        return fallback_encoder.default(obj)
+
+    content = orjson.dumps(
+        data, default=default, option=orjson.OPT_PASSTHROUGH_DATETIME
+    )
+    if fragments:
+        placeholder_pattern = re.compile(
+            b'"' + re.escape(placeholder_prefix.encode('ascii')) + b'([0-9]+)"'
+        )
+        content = placeholder_pattern.sub(
+            lambda match: fragments[int(match.group(1))], content
+        )
+    # `JSONRenderer` escapes these so that the JSON is valid JavaScript too.
+    return content.replace(
+        '\u2028'.encode('utf-8'), b'\\u2028'
+    ).replace(
+        '\u2029'.encode('utf-8'), b'\\u2029'
+    )
@@ -0,0 +1,65 @@
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Concat
+
+from .models import Book
+
+
+# The `simple` configuration doesn't stem words or drop stop words, which suits
+# names and titles in many languages.
+SEARCH_CONFIG = 'simple'
+# The title and author names in the search text are joined with a line break,
+# which search terms don't normally contain, so that a term doesn't match across
+# two of them.
+SEARCH_TEXT_SEPARATOR = '\n'
+
+
+def get_author_names(separator):
+    return Subquery(
+        Book.authors.through.objects.filter(
+            book=OuterRef('pk')
+        ).values('book').annotate(
+            names=StringAgg('person__name', separator)
+        ).values('names')
+    )
+
+
+def get_search_query(terms):
+    """
+    This makes a full-text query for ranking books by how well their titles
+    and author names match the terms.
+    """
+
+    lexemes = []
+    for term in terms:
+        quoted_term = term.replace('\\', '\\\\').replace("'", "''")
+        lexemes.append("'%s':*" % quoted_term)
+
+    return SearchQuery(
+        ' & '.join(lexemes),
+        config=SEARCH_CONFIG,
+        search_type='raw'
+    )
+
+
+def update_search_vectors(books=None):
+    """
+    This refreshes the search vectors and search texts of the given books (or
+    all books).
+    """
+
+    if books is None:
+        books = Book.objects.all()
+
+    books.update(
+        search_text=Concat(
+            Coalesce('title', Value('')),
+            Value(SEARCH_TEXT_SEPARATOR),
+            Coalesce(get_author_names(SEARCH_TEXT_SEPARATOR), Value(''))
+        ),
+        search_vector=(
+            SearchVector('title', config=SEARCH_CONFIG, weight='A') +
+            SearchVector(get_author_names(' '), config=SEARCH_CONFIG, weight='B')
+        )
+    )
@@ -1,6 +1,23 @@
+import json
+
 from rest_framework import serializers
 
 from .models import *
+from .renderers import JSONFragment
+
+
+# These are the relations of books that fields of `BookSerializer` use.
+BOOK_FIELD_RELATIONS = {
+    'authors': 'authors',
+    'bookshelves': 'bookshelves',
+    'editors': 'editors',
+    'formats': 'format_set',
+    'languages': 'languages',
+    'subjects': 'subjects',
+    'summaries': 'summary_set',
+    'translators': 'translators',
+}
+BOOK_RELATIONS = tuple(sorted(BOOK_FIELD_RELATIONS.values()))
 
 
 class BookshelfSerializer(serializers.ModelSerializer):
@@ -70,6 +87,12 @@ class BookSerializer(serializers.ModelSerializer):
             'download_count'
         )
 
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
     def get_bookshelves(self, book):
         bookshelves = [bookshelf.name for bookshelf in book.bookshelves.all()]
         bookshelves.sort()
@@ -95,3 +118,85 @@ class BookSerializer(serializers.ModelSerializer):
         summaries = [summary.text for summary in book.get_summaries()]
         summaries.sort()
         return summaries
+
+
+class BookDocumentSerializer(serializers.BaseSerializer):
+    """
+    This gives the stored API data of books (with their documents selected),
+    falling back to `BookSerializer` for any book without a document. Whole
+    documents are given as JSON fragments, which are rendered without being
+    decoded.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.selected_fields = fields
+
+    def to_representation(self, book):
+        try:
+            document = book.document
+        except BookDocument.DoesNotExist:
+            return BookSerializer(book, fields=self.selected_fields).data
+        if self.selected_fields is None:
+            return JSONFragment(document.content)
+        data = json.loads(document.content)
+        return {name: data[name] for name in self.selected_fields}
+
+
+def get_people_data(people):
+    return [
+        {
+            'name': person.name,
+            'birth_year': person.birth_year,
+            'death_year': person.death_year,
+        }
+        for person in people.all()
+    ]
+
+
+def get_sorted_values(objects, attribute):
+    return sorted(getattr(obj, attribute) for obj in objects)
+
+
+# These give the values of `BookSerializer`'s fields, in its order.
+FAST_BOOK_FIELDS = (
+    ('id', lambda book: book.gutenberg_id),
+    ('title', lambda book: book.title),
+    ('authors', lambda book: get_people_data(book.authors)),
+    ('summaries', lambda book: get_sorted_values(book.get_summaries(), 'text')),
+    ('editors', lambda book: get_people_data(book.editors)),
+    ('translators', lambda book: get_people_data(book.translators)),
+    ('subjects', lambda book: get_sorted_values(book.subjects.all(), 'name')),
+    (
+        'bookshelves',
+        lambda book: get_sorted_values(book.bookshelves.all(), 'name')
+    ),
+    ('languages', lambda book: get_sorted_values(book.languages.all(), 'code')),
+    ('copyright', lambda book: book.copyright),
+    ('media_type', lambda book: book.media_type),
+    (
+        'formats',
+        lambda book: {f.mime_type: f.url for f in book.get_formats()}
+    ),
+    ('download_count', lambda book: book.download_count),
+)
+
+
+class FastBookSerializer(serializers.BaseSerializer):
+    """
+    This gives the same data as `BookSerializer` by reading the attributes of
+    books (with their relations prefetched) directly, without the work that
+    DRF does for each field of each book.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.book_fields = FAST_BOOK_FIELDS
+        if fields is not None:
+            self.book_fields = [
+                (name, get_value) for name, get_value in FAST_BOOK_FIELDS
+                if name in fields
+            ]
+
+    def to_representation(self, book):
+        return {name: get_value(book) for name, get_value in self.book_fields}
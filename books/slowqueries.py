@@ -0,0 +1,99 @@
+from contextlib import contextmanager
+from time import perf_counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .models import SlowQuerySample
+from .parameters import get_filter_parameters, get_sort_parameter
+
+
+SAMPLE_CACHE_KEY_PREFIX = 'books:slow_query_sample:'
+
+
+class QueryRecorder:
+    """ This records the SQL, parameters and time of each `SELECT` query. """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start_time = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            # Other queries (e.g. of a database cache) aren't safe to explain
+            # with `ANALYZE`, which runs them.
+            if sql.lstrip()[:6].upper() == 'SELECT':
+                self.queries.append((perf_counter() - start_time, sql, params))
+
+
+def explain_slow_query_sample(sample):
+    """
+    This stores the plan of a sample's query from `EXPLAIN (ANALYZE, BUFFERS)`,
+    which runs the query again.
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + sample.sql)
+        sample.plan = '\n'.join(row[0] for row in cursor.fetchall())
+    sample.save(update_fields=['plan'])
+
+
+def get_parameter_signature(action, query_params):
+    """
+    This gives the view action of a book request with the names of its filter
+    and pagination parameters and its sort order, e.g.
+    `list:languages,search;sort=relevance`, so that requests whose queries have
+    the same shape are grouped together.
+    """
+
+    names = set(get_filter_parameters(query_params))
+    names.update(name for name in ('cursor', 'page') if name in query_params)
+    return '%s:%s;sort=%s' % (
+        action,
+        ','.join(sorted(names)) or 'none',
+        get_sort_parameter(query_params)
+    )
+
+
+@contextmanager
+def sample_slow_queries(request, action):
+    """
+    This records the slowest query made in the context if the context takes
+    at least `SLOW_QUERY_THRESHOLD` milliseconds. Each parameter signature is
+    sampled at most once every `SLOW_QUERY_SAMPLE_INTERVAL` seconds. The
+    queries aren't explained here, so that requests don't wait for them to run
+    again; `explain_slow_query_sample` does that later.
+    """
+
+    threshold = settings.SLOW_QUERY_THRESHOLD
+    if not threshold:
+        yield
+        return
+
+    recorder = QueryRecorder()
+    start_time = perf_counter()
+    with connection.execute_wrapper(recorder):
+        yield
+    duration = (perf_counter() - start_time) * 1000
+
+    if duration < threshold or not recorder.queries:
+        return
+    signature = get_parameter_signature(action, request.query_params)
+    if not cache.add(
+        SAMPLE_CACHE_KEY_PREFIX + signature,
+        True,
+        settings.SLOW_QUERY_SAMPLE_INTERVAL
+    ):
+        return
+
+    query_duration, sql, params = max(recorder.queries, key=lambda query: query[0])
+    SlowQuerySample.objects.create(
+        duration=duration,
+        parameters=request.META.get('QUERY_STRING', ''),
+        query_duration=query_duration * 1000,
+        signature=signature,
+        sql=connection.ops.compose_sql(sql, params)
+    )
@@ -0,0 +1,244 @@
+from contextlib import contextmanager
+from time import sleep
+
+from django.core.management.color import no_style
+from django.db import OperationalError, connection, transaction
+
+from .models import *
+
+
+STAGING_SCHEMA = 'books_staging'
+RETIRED_SCHEMA = 'books_retired'
+
+# These are the models whose tables are built in the staging schema and
+# swapped in: books and the objects they share, which refer to no other staged
+# tables, and then the books' own data and the import's records, which may
+# refer to books. `get_staged_models` puts the tables of `Book`'s many-to-many
+# relations between the two, so that tables come before ones that refer to
+# them.
+STAGED_BOOK_MODELS = (
+    Book,
+    Bookshelf,
+    Language,
+    Person,
+    Subject,
+)
+STAGED_BOOK_DATA_MODELS = (
+    BookDocument,
+    CatalogCheckpoint,
+    CatalogFile,
+    Format,
+    QuarantinedBook,
+    Summary,
+)
+STAGED_MODELS = STAGED_BOOK_MODELS + STAGED_BOOK_DATA_MODELS
+
+# Swapping tables needs exclusive locks on them, and API requests wait behind
+# a request for those locks, so the swap gives up quickly and tries again
+# rather than holding them up.
+SWAP_ATTEMPTS = 5
+SWAP_LOCK_TIMEOUT = '2s'
+SWAP_RETRY_DELAY = 5
+
+
+def create_staging_tables():
+    """
+    This makes the staging schema with copies of the live catalog tables, if it
+    doesn't exist yet (e.g. from an unfinished import), giving whether it was
+    made. The tables don't have the indexes that only the API uses until
+    `finish_staging_tables` adds them.
+    """
+
+    if staging_tables_exist():
+        return False
+
+    quote_name = connection.ops.quote_name
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE SCHEMA %s' % quote_name(STAGING_SCHEMA))
+
+        with use_staging_tables():
+            with connection.schema_editor() as schema_editor:
+                for model in STAGED_MODELS:
+                    schema_editor.create_model(model)
+            with connection.schema_editor() as schema_editor:
+                for model in STAGED_MODELS:
+                    for index in model._meta.indexes:
+                        schema_editor.remove_index(model, index)
+
+            live_schema = get_live_schema()
+            with connection.cursor() as cursor:
+                for model in get_staged_models():
+                    if model is CatalogCheckpoint:
+                        continue
+                    columns = ', '.join(
+                        quote_name(field.column)
+                        for field in model._meta.local_concrete_fields
+                    )
+                    cursor.execute(
+                        'INSERT INTO %s.%s (%s) SELECT %s FROM %s.%s' % (
+                            quote_name(STAGING_SCHEMA),
+                            quote_name(model._meta.db_table),
+                            columns,
+                            columns,
+                            quote_name(live_schema),
+                            quote_name(model._meta.db_table)
+                        )
+                    )
+                for sql in connection.ops.sequence_reset_sql(
+                    no_style(), get_staged_models()
+                ):
+                    cursor.execute(sql)
+
+    return True
+
+
+def drop_staging_tables():
+    """ This drops the staging schema and any tables in it. """
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DROP SCHEMA IF EXISTS %s CASCADE'
+            % connection.ops.quote_name(STAGING_SCHEMA)
+        )
+
+
+def finish_staging_tables():
+    """
+    This adds the indexes that the API uses to the staged tables and refreshes
+    their statistics for the query planner. Indexes that the tables already
+    have (e.g. from an earlier run whose swap failed) are skipped.
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT indexname FROM pg_indexes WHERE schemaname = %s',
+            [STAGING_SCHEMA]
+        )
+        index_names = {row[0] for row in cursor.fetchall()}
+
+    with use_staging_tables():
+        with connection.schema_editor() as schema_editor:
+            for model in STAGED_MODELS:
+                for index in model._meta.indexes:
+                    if index.name not in index_names:
+                        schema_editor.add_index(model, index)
+
+    with connection.cursor() as cursor:
+        for model in get_staged_models():
+            cursor.execute('ANALYZE %s' % get_staged_table_name(model))
+
+
+def get_live_schema():
+    """ This gives the schema of the live catalog tables. """
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT table_schema FROM information_schema.tables '
+            'WHERE table_name = %s AND table_schema <> %s '
+            'ORDER BY array_position(current_schemas(false), table_schema::name) '
+            'LIMIT 1',
+            [Book._meta.db_table, STAGING_SCHEMA]
+        )
+        return cursor.fetchone()[0]
+
+
+def get_staged_models():
+    """
+    This gives `STAGED_MODELS` along with the models of `Book`'s many-to-many
+    relations.
+    """
+
+    relation_models = [
+        field.remote_field.through for field in Book._meta.local_many_to_many
+    ]
+    return (
+        STAGED_BOOK_MODELS + tuple(relation_models) + STAGED_BOOK_DATA_MODELS
+    )
+
+
+def get_staged_table_name(model):
+    quote_name = connection.ops.quote_name
+    return '%s.%s' % (
+        quote_name(STAGING_SCHEMA), quote_name(model._meta.db_table)
+    )
+
+
+def staging_tables_exist():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM information_schema.schemata WHERE schema_name = %s',
+            [STAGING_SCHEMA]
+        )
+        return cursor.fetchone() is not None
+
+
+def swap_staging_tables():
+    """
+    This moves the live catalog tables out of the way and the staged ones into
+    their place in one transaction, so that queries see either the old catalog
+    or the new one, and then drops the old tables.
+    """
+
+    quote_name = connection.ops.quote_name
+    live_schema = get_live_schema()
+    tables = [model._meta.db_table for model in get_staged_models()]
+
+    for attempt in range(1, SWAP_ATTEMPTS + 1):
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    "SET LOCAL lock_timeout = '%s'" % SWAP_LOCK_TIMEOUT
+                )
+                cursor.execute(
+                    'LOCK TABLE %s IN ACCESS EXCLUSIVE MODE' % ', '.join(
+                        '%s.%s' % (quote_name(live_schema), quote_name(table))
+                        for table in tables
+                    )
+                )
+                cursor.execute(
+                    'DROP SCHEMA IF EXISTS %s CASCADE'
+                    % quote_name(RETIRED_SCHEMA)
+                )
+                cursor.execute('CREATE SCHEMA %s' % quote_name(RETIRED_SCHEMA))
+                for table in tables:
+                    cursor.execute('ALTER TABLE %s.%s SET SCHEMA %s' % (
+                        quote_name(live_schema),
+                        quote_name(table),
+                        quote_name(RETIRED_SCHEMA)
+                    ))
+                for table in tables:
+                    cursor.execute('ALTER TABLE %s.%s SET SCHEMA %s' % (
+                        quote_name(STAGING_SCHEMA),
+                        quote_name(table),
+                        quote_name(live_schema)
+                    ))
+            break
+        except OperationalError:
+            if attempt == SWAP_ATTEMPTS:
+                raise
+            sleep(SWAP_RETRY_DELAY)
+
+    with connection.cursor() as cursor:
+        cursor.execute('DROP SCHEMA %s CASCADE' % quote_name(RETIRED_SCHEMA))
+        cursor.execute('DROP SCHEMA %s' % quote_name(STAGING_SCHEMA))
+
+
+@contextmanager
+def use_staging_tables():
+    """
+    This makes unqualified table names refer to the staged catalog tables
+    within the context (and to the live tables for everything else).
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW search_path')
+        search_path = cursor.fetchone()[0]
+        cursor.execute('SET search_path TO %s, %s' % (
+            connection.ops.quote_name(STAGING_SCHEMA), search_path
+        ))
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('SET search_path TO %s' % search_path)
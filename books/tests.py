@@ -1,3 +1,1450 @@
-from django.test import TestCase
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+from functools import partial
+import gzip
+from io import BytesIO, StringIO
+from itertools import combinations
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import tarfile
+from tempfile import TemporaryDirectory
+from time import sleep
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Max, Q
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.renderers import JSONRenderer
+
+from . import compression, renderers, slowqueries, utils
+from .benchmarks import run_api_benchmarks, write_synthetic_catalog
+from .cache import bump_catalog_version
+from .compression import get_accepted_encoding
+from .management.commands import updatecatalog
+from .documents import get_inconsistent_book_ids, update_book_documents
+from .models import *
+from .pagination import (
+    BookKeysetPagination, get_position_filter, get_reversed_field
+)
+from .renderers import BookJSONRenderer, JSONFragment
+from .search import update_search_vectors
+from .serializers import BOOK_RELATIONS, BookSerializer, FastBookSerializer
+from .staging import (
+    create_staging_tables,
+    drop_staging_tables,
+    finish_staging_tables,
+    staging_tables_exist,
+    swap_staging_tables,
+    use_staging_tables,
+)
+from .utils import extract_book, get_book
+from .views import BookViewSet
+
+
+TEST_RDF_DIR = os.path.join(os.path.dirname(__file__), 'test_data', 'rdf')
+TEST_BOOK_IDS = [84, 1342, 5200, 90001]
+TEST_BOOKS_DIR = os.path.join(os.path.dirname(__file__), 'test_data', 'books')
+
+
+class BookTestCase(TestCase):
+    def setUp(self):
+        # Cached data would otherwise leak between tests.
+        cache.clear()
+
+
+def create_book(gutenberg_id, related_count=1, **fields):
+    book = Book.objects.create(
+        gutenberg_id=gutenberg_id,
+        copyright=fields.get('copyright', False),
+        download_count=fields.get('download_count', gutenberg_id),
+        media_type=fields.get('media_type', 'Text'),
+        title=fields.get('title', 'Book %d' % gutenberg_id)
+    )
+
+    for i in range(related_count):
+        name = '%d-%d' % (gutenberg_id, i)
+        book.authors.add(Person.objects.create(name='Author ' + name))
+        book.editors.add(Person.objects.create(name='Editor ' + name))
+        book.translators.add(Person.objects.create(name='Translator ' + name))
+        book.bookshelves.add(Bookshelf.objects.create(name='Shelf ' + name))
+        book.languages.add(Language.objects.create(code=name[-4:]))
+        book.subjects.add(Subject.objects.create(name='Subject ' + name))
+        Format.objects.create(
+            book=book, mime_type='text/' + name, url='https://example.org/' + name
+        )
+        Summary.objects.create(book=book, text='Summary ' + name)
+
+    return book
+
+
+class BookListQueryCountTests(BookTestCase):
+    def get_query_count(self, path):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_list_query_count_does_not_grow_with_related_rows(self):
+        create_book(1, related_count=1)
+        few_related_count = self.get_query_count('/books/')
+
+        for gutenberg_id in range(2, 12):
+            create_book(gutenberg_id, related_count=3)
+        many_related_count = self.get_query_count('/books/')
+
+        self.assertEqual(few_related_count, many_related_count)
+
+    def test_list_query_count(self):
+        for gutenberg_id in range(1, 6):
+            create_book(gutenberg_id, related_count=2)
+
+        # This takes one catalog version query, one count query, one page
+        # query, and one query per relation.
+        with self.assertNumQueries(11):
+            response = self.client.get('/books/')
+
+        results = response.json()['results']
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len(results[0]['authors']), 2)
+        self.assertEqual(len(results[0]['formats']), 2)
+        self.assertEqual(len(results[0]['summaries']), 2)
+
+
+class BookSearchTests(BookTestCase):
+    def setUp(self):
+        super().setUp()
+        dickens = Person.objects.create(name='Dickens, Charles')
+        austen = Person.objects.create(name='Austen, Jane')
+
+        create_book(1, related_count=0, title='Great Expectations', download_count=10)
+        create_book(2, related_count=0, title='A Tale of Two Cities', download_count=30)
+        create_book(3, related_count=0, title='Pride and Prejudice', download_count=20)
+        create_book(4, related_count=0, title='Great Dickens Stories', download_count=5)
+        Book.objects.get(gutenberg_id=1).authors.add(dickens)
+        Book.objects.get(gutenberg_id=2).authors.add(dickens)
+        Book.objects.get(gutenberg_id=3).authors.add(austen)
+
+        update_search_vectors()
+
+    def get_ids(self, query):
+        response = self.client.get('/books/?' + query)
+        self.assertEqual(response.status_code, 200)
+        return [book['id'] for book in response.json()['results']]
+
+    def test_search_matches_titles_and_author_names(self):
+        self.assertEqual(self.get_ids('search=dickens'), [2, 1, 4])
+        self.assertEqual(self.get_ids('search=prejudice'), [3])
+
+    def test_search_requires_every_term(self):
+        self.assertEqual(self.get_ids('search=dickens%20great'), [1, 4])
+        self.assertEqual(self.get_ids('search=austen%20great'), [])
+
+    def test_search_matches_substrings_case_insensitively(self):
+        self.assertEqual(self.get_ids('search=DICK%20expect'), [1])
+        self.assertEqual(self.get_ids('search=ken'), [2, 1, 4])
+        self.assertEqual(self.get_ids('search=judice'), [3])
+
+    def test_search_ignores_empty_terms(self):
+        self.assertEqual(self.get_ids('search=%20'), [2, 3, 1, 4])
+        self.assertEqual(self.get_ids('search=jane%20%20austen'), [3])
+
+    def test_search_with_quotes_and_backslashes(self):
+        self.assertEqual(self.get_ids("search=o'brien%5C"), [])
+
+    def test_relevance_sort_prefers_title_matches(self):
+        self.assertEqual(self.get_ids('search=dickens&sort=relevance'), [4, 2, 1])
+
+
+class SubstringIndexTests(BookTestCase):
+    def get_plan(self, queryset):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def test_icontains_filters_use_trigram_indexes(self):
+        plans = [
+            self.get_plan(Book.objects.filter(search_text__icontains='dick')),
+            self.get_plan(Book.objects.filter(title__icontains='great')),
+            self.get_plan(Bookshelf.objects.filter(name__icontains='child')),
+            self.get_plan(Person.objects.filter(name__icontains='dick')),
+            self.get_plan(Subject.objects.filter(name__icontains='child')),
+        ]
+        for plan in plans:
+            self.assertIn('_trgm', plan)
+
+    def test_mime_type_prefix_filter_uses_index(self):
+        plan = self.get_plan(Format.objects.filter(mime_type__startswith='text/'))
+        self.assertIn('books_format_mime_type', plan)
+
+
+def get_joined_book_ids(parameters):
+    """ This filters books with the joins and `DISTINCT` used before `EXISTS`. """
+
+    queryset = Book.objects.order_by('-download_count')
+
+    if 'author_year_end' in parameters:
+        year = int(parameters['author_year_end'])
+        queryset = queryset.filter(
+            Q(authors__birth_year__lte=year) | Q(authors__death_year__lte=year)
+        )
+    if 'author_year_start' in parameters:
+        year = int(parameters['author_year_start'])
+        queryset = queryset.filter(
+            Q(authors__birth_year__gte=year) | Q(authors__death_year__gte=year)
+        )
+    if 'copyright' in parameters:
+        queryset = queryset.exclude(copyright=None)
+    if 'ids' in parameters:
+        ids = [int(id) for id in parameters['ids'].split(',')]
+        queryset = queryset.filter(gutenberg_id__in=ids)
+    if 'languages' in parameters:
+        codes = parameters['languages'].lower().split(',')
+        queryset = queryset.filter(languages__code__in=codes)
+    if 'mime_type' in parameters:
+        queryset = queryset.filter(
+            format__mime_type__startswith=parameters['mime_type']
+        )
+    if 'search' in parameters:
+        for term in parameters['search'].split(' '):
+            queryset = queryset.filter(
+                Q(authors__name__icontains=term) | Q(title__icontains=term)
+            )
+    if 'topic' in parameters:
+        topic = parameters['topic']
+        queryset = queryset.filter(
+            Q(bookshelves__name__icontains=topic) |
+            Q(subjects__name__icontains=topic)
+        )
+
+    return list(queryset.distinct().values_list('gutenberg_id', flat=True))
+
+
+class BookFilterTests(BookTestCase):
+    parameters = {
+        'author_year_end': '1850',
+        'author_year_start': '1800',
+        'copyright': 'true,false',
+        'ids': '1,2,3,5,8,9',
+        'languages': 'EN,fr',
+        'mime_type': 'text/',
+        'search': 'john',
+        'topic': 'fiction',
+    }
+
+    def setUp(self):
+        super().setUp()
+        people = [
+            Person.objects.create(name='Smith, John', birth_year=1790, death_year=1860),
+            Person.objects.create(name='Doe, John', birth_year=1820, death_year=1880),
+            Person.objects.create(name='Roe, Jane', birth_year=1700, death_year=1760),
+            Person.objects.create(name='Poe, Anne', birth_year=1900),
+        ]
+        languages = [
+            Language.objects.create(code=code) for code in ('en', 'fr', 'de')
+        ]
+        shelves = [
+            Bookshelf.objects.create(name=name)
+            for name in ('Science Fiction', 'Fiction Classics', 'Poetry')
+        ]
+        subjects = [
+            Subject.objects.create(name=name)
+            for name in ('Fiction -- History', 'Historical fiction', 'Travel')
+        ]
+        mime_types = ['text/html', 'text/plain', 'application/epub+zip']
+
+        for index in range(12):
+            book = create_book(
+                index + 1,
+                related_count=0,
+                copyright=[True, False, None][index % 3],
+                download_count=100 - index
+            )
+            book.authors.add(*people[index % 4:index % 4 + 2 + index % 2])
+            book.languages.add(*languages[index % 3:])
+            book.bookshelves.add(*shelves[index % 3:])
+            book.subjects.add(*subjects[index % 2:index % 3 + 1])
+            for mime_type in mime_types[index % 3:]:
+                Format.objects.create(
+                    book=book, mime_type=mime_type, url='https://example.org/'
+                )
+
+        update_search_vectors()
+
+    def test_filters_match_joined_filters_for_every_combination(self):
+        names = sorted(self.parameters)
+        for count in range(len(names) + 1):
+            for combination in combinations(names, count):
+                parameters = {name: self.parameters[name] for name in combination}
+                with self.subTest(parameters=parameters):
+                    response = self.client.get('/books/', parameters)
+                    self.assertEqual(response.status_code, 200)
+                    ids = [book['id'] for book in response.json()['results']]
+                    self.assertEqual(ids, get_joined_book_ids(parameters))
+                    self.assertEqual(response.json()['count'], len(ids))
+
+    def test_filtered_query_does_not_use_distinct(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get('/books/', self.parameters)
+        for query in context.captured_queries:
+            self.assertNotIn('DISTINCT', query['sql'])
+
+
+class BookKeysetPaginationTests(BookTestCase):
+    def setUp(self):
+        super().setUp()
+        # Repeated download counts check the tie-breaking field.
+        for gutenberg_id in range(1, 71):
+            create_book(gutenberg_id, related_count=0, download_count=gutenberg_id // 3)
+
+    def get_all_ids(self, url):
+        ids = []
+        while url is not None:
+            data = self.client.get(url).json()
+            self.assertNotIn('count', data)
+            ids += [book['id'] for book in data['results']]
+            url = data['next']
+        return ids
+
+    def test_cursor_pages_cover_every_book_in_order(self):
+        for sort in ('popular', 'ascending', 'descending'):
+            with self.subTest(sort=sort):
+                expected_ids = list(
+                    Book.objects.order_by(*BookKeysetPagination.orderings[sort])
+                    .values_list('gutenberg_id', flat=True)
+                )
+                ids = self.get_all_ids('/books/?cursor=&sort=' + sort)
+                self.assertEqual(ids, expected_ids)
+
+    def test_previous_links_return_earlier_pages(self):
+        first_page = self.client.get('/books/?cursor=').json()
+        self.assertIsNone(first_page['previous'])
+        second_page = self.client.get(first_page['next']).json()
+        third_page = self.client.get(second_page['next']).json()
+        self.assertIsNone(third_page['next'])
+
+        previous_page = self.client.get(third_page['previous']).json()
+        self.assertEqual(previous_page['results'], second_page['results'])
+        previous_page = self.client.get(previous_page['previous']).json()
+        self.assertEqual(previous_page['results'], first_page['results'])
+        self.assertIsNone(previous_page['previous'])
+
+    def test_cursor_pages_skip_count_query(self):
+        first_page = self.client.get('/books/?cursor=').json()
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(first_page['next'])
+        for query in context.captured_queries:
+            self.assertNotIn('COUNT(', query['sql'])
+
+    def test_cursor_position_bounds_the_index_scan(self):
+        for reverse in (False, True):
+            with self.subTest(reverse=reverse):
+                ordering = BookKeysetPagination.orderings['popular']
+                if reverse:
+                    ordering = [get_reversed_field(field) for field in ordering]
+                queryset = Book.objects.order_by(*ordering).filter(
+                    get_position_filter(
+                        BookKeysetPagination.orderings['popular'], [10, 30], reverse
+                    )
+                )
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                plan = queryset.explain()
+                self.assertIn('books_book_popular_idx', plan)
+                self.assertRegex(plan, r'Index Cond: \(download_count [<>]= 10\)')
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/books/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+
+class BookFieldSelectionTests(BookTestCase):
+    def setUp(self):
+        super().setUp()
+        for gutenberg_id in range(1, 4):
+            create_book(gutenberg_id, related_count=2)
+
+    def test_fields_are_selected(self):
+        results = self.client.get('/books/?fields=formats,id,title,unknown').json()['results']
+        self.assertEqual(list(results[0]), ['id', 'title', 'formats'])
+        self.assertEqual(len(results[0]['formats']), 2)
+
+        book = self.client.get('/books/2/?omit=summaries,authors').json()
+        self.assertNotIn('summaries', book)
+        self.assertNotIn('authors', book)
+        self.assertIn('editors', book)
+
+        book = self.client.get('/books/2/?fields=id,title&omit=title').json()
+        self.assertEqual(book, {'id': 2})
+
+    def test_unselected_relations_are_not_queried(self):
+        # This takes one catalog version query, one count query, one page
+        # query, and one formats query.
+        with CaptureQueriesContext(connection) as context:
+            self.client.get('/books/?fields=id,title,formats')
+        self.assertEqual(len(context.captured_queries), 4)
+        for query in context.captured_queries:
+            self.assertNotIn('books_person', query['sql'])
+
+    def test_invalid_or_complete_selections_are_ignored(self):
+        full_results = self.client.get('/books/').json()['results']
+        for query_string in ('fields=unknown', 'omit=', 'omit=unknown'):
+            with self.assertNumQueries(0):
+                response = self.client.get('/books/?' + query_string)
+            self.assertEqual(response.json()['results'], full_results)
+
+        response = self.client.get('/books/?fields=id')
+        self.assertEqual(response.json()['results'][0], {'id': 3})
+
+    @override_settings(BOOK_DOCUMENTS=True)
+    def test_documents_are_trimmed(self):
+        update_book_documents()
+        results = self.client.get('/books/?fields=id,languages').json()['results']
+        self.assertEqual(results[0], {'id': 3, 'languages': ['3-0', '3-1']})
+
+
+class FastBookSerializerTests(BookTestCase):
+    def assertSerializersAgree(self, books, **kwargs):
+        renderer = JSONRenderer()
+        for book in books:
+            with self.subTest(id=book.gutenberg_id, **kwargs):
+                self.assertEqual(
+                    renderer.render(FastBookSerializer(book, **kwargs).data),
+                    renderer.render(BookSerializer(book, **kwargs).data)
+                )
+
+    def test_imported_books_are_serialized_identically(self):
+        with override_settings(CATALOG_RDF_DIR=TEST_RDF_DIR), \
+                mock.patch.object(updatecatalog, 'log'):
+            updatecatalog.put_catalog_in_db()
+        books = Book.objects.prefetch_related(*BOOK_RELATIONS)
+        self.assertEqual(len(books), len(TEST_BOOK_IDS))
+        self.assertSerializersAgree(books)
+        self.assertSerializersAgree(books, fields=['formats', 'id', 'summaries'])
+
+    def test_unusual_books_are_serialized_identically(self):
+        create_book(1, related_count=0)
+        create_book(2, related_count=3, copyright=None)
+        book = create_book(3, related_count=2, title=None)
+        book.authors.add(Person.objects.create(name='Anonymous', death_year=-400))
+        Book.objects.filter(gutenberg_id=1).update(download_count=None)
+        self.assertSerializersAgree(
+            Book.objects.prefetch_related(*BOOK_RELATIONS)
+        )
+
+    def test_responses_are_identical(self):
+        for gutenberg_id in range(1, 6):
+            create_book(gutenberg_id, related_count=2)
+        for path in ('/books/', '/books/?fields=id,authors', '/books/3/'):
+            with self.subTest(path=path):
+                response = self.client.get(path)
+                cache.clear()
+                with override_settings(BOOK_FAST_SERIALIZER=True):
+                    fast_response = self.client.get(path)
+                cache.clear()
+                self.assertEqual(fast_response.content, response.content)
+
+    def test_benchmark_command_compares_serializers(self):
+        for gutenberg_id in range(1, 6):
+            create_book(gutenberg_id, related_count=2)
+        stdout = StringIO()
+        call_command('benchmarkserializers', '--repeat=1', stdout=stdout)
+        self.assertIn('ms of CPU time per page', stdout.getvalue())
+        self.assertIn('times as fast', stdout.getvalue())
+
+
+class BookExportTests(BookTestCase):
+    def setUp(self):
+        super().setUp()
+        for gutenberg_id in (5, 3, 1, 4, 2):
+            create_book(gutenberg_id, related_count=2)
+
+    def get_export_lines(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return b''.join(response.streaming_content).splitlines()
+
+    def test_books_are_exported_in_chunks(self):
+        with mock.patch.object(BookViewSet, 'export_chunk_size', 2):
+            lines = self.get_export_lines('/books/export.ndjson')
+        self.assertEqual(
+            [json.loads(line)['id'] for line in lines], [1, 2, 3, 4, 5]
+        )
+        self.assertEqual(json.loads(lines[2]), self.client.get('/books/3/').json())
+
+    def test_ndjson_is_acceptable(self):
+        for accept in ('application/x-ndjson', 'application/*', '*/*'):
+            response = self.client.get('/books/export.ndjson', HTTP_ACCEPT=accept)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 5)
+
+    def test_export_uses_list_parameters(self):
+        lines = self.get_export_lines(
+            '/books/export.ndjson?ids=1,2,4&sort=descending&fields=id,title'
+        )
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            [
+                {'id': 1, 'title': 'Book 1'},
+                {'id': 2, 'title': 'Book 2'},
+                {'id': 4, 'title': 'Book 4'},
+            ]
+        )
+
+    def test_documents_are_exported_identically(self):
+        lines = self.get_export_lines('/books/export.ndjson')
+        update_book_documents()
+        with override_settings(BOOK_DOCUMENTS=True):
+            self.assertEqual(self.get_export_lines('/books/export.ndjson'), lines)
+
+
+class BookCountCacheTests(BookTestCase):
+    def setUp(self):
+        super().setUp()
+        for gutenberg_id in range(1, 6):
+            create_book(gutenberg_id, related_count=1)
+
+    def get_count(self, query):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/books/?' + query)
+        count_queries = [
+            query for query in context.captured_queries
+            if 'COUNT(' in query['sql']
+        ]
+        return response.json()['count'], len(count_queries)
+
+    def test_count_is_cached_for_equivalent_parameters(self):
+        self.assertEqual(self.get_count('languages=1-0,2-0'), (2, 1))
+        self.assertEqual(self.get_count('languages=2-0,1-0,1-0'), (2, 0))
+        self.assertEqual(self.get_count('languages=2-0,1-0&page=1'), (2, 0))
+        self.assertEqual(self.get_count('languages=1-0'), (1, 1))
+
+    def test_count_is_invalidated_by_new_catalog_version(self):
+        self.assertEqual(self.get_count(''), (5, 1))
+        create_book(6)
+        self.assertEqual(self.get_count(''), (5, 0))
+
+        bump_catalog_version()
+        self.assertEqual(self.get_count(''), (6, 1))
+
+    @override_settings(BOOK_COUNT_ESTIMATE_THRESHOLD=1)
+    def test_large_counts_are_estimated(self):
+        count, count_query_count = self.get_count('')
+        self.assertGreaterEqual(count, 1)
+        self.assertEqual(count_query_count, 0)
+
+    @override_settings(BOOK_COUNT_ESTIMATE_THRESHOLD=1000000)
+    def test_small_counts_are_exact(self):
+        self.assertEqual(self.get_count(''), (5, 1))
+
+
+class BookResponseCacheTests(BookTestCase):
+    def setUp(self):
+        super().setUp()
+        for gutenberg_id in range(1, 4):
+            create_book(gutenberg_id, related_count=1)
+
+    def test_equivalent_requests_are_served_from_cache(self):
+        response = self.client.get('/books/?ids=1,2&languages=1-0,2-0')
+        with self.assertNumQueries(0):
+            cached_response = self.client.get('/books/?languages=2-0,1-0&ids=2,1,2')
+        self.assertEqual(cached_response.json(), response.json())
+
+    def test_book_detail_is_cached(self):
+        response = self.client.get('/books/2/')
+        with self.assertNumQueries(0):
+            cached_response = self.client.get('/books/2/')
+        self.assertEqual(cached_response.json(), response.json())
+
+    def test_different_requests_are_not_shared(self):
+        self.assertEqual(self.client.get('/books/?ids=1').json()['count'], 1)
+        self.assertEqual(self.client.get('/books/?ids=1,2').json()['count'], 2)
+        self.assertEqual(self.client.get('/books/1/').json()['id'], 1)
+        self.assertEqual(self.client.get('/books/2/').json()['id'], 2)
+
+    @override_settings(ALLOWED_HOSTS=['*'])
+    def test_pagination_links_keep_their_hosts(self):
+        for gutenberg_id in range(4, 40):
+            create_book(gutenberg_id, related_count=0)
+        for host in ('example.org', 'example.com'):
+            response = self.client.get('/books/', HTTP_HOST=host)
+            self.assertTrue(response.json()['next'].startswith('http://' + host))
+
+    def test_new_catalog_version_invalidates_cache(self):
+        self.assertEqual(self.client.get('/books/').json()['count'], 3)
+        create_book(4)
+        self.assertEqual(self.client.get('/books/').json()['count'], 3)
+
+        bump_catalog_version()
+        self.assertEqual(self.client.get('/books/').json()['count'], 4)
+
+    @override_settings(BOOK_RESPONSE_CACHE_TIMEOUT=0)
+    def test_cache_can_be_disabled(self):
+        self.client.get('/books/1/')
+        with CaptureQueriesContext(connection) as context:
+            self.client.get('/books/1/')
+        self.assertGreater(len(context.captured_queries), 0)
+
+
+class BookConditionalRequestTests(BookTestCase):
+    def setUp(self):
+        super().setUp()
+        create_book(1)
+        bump_catalog_version()
+
+    def assertNoBookQueries(self, path, **headers):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path, **headers)
+        for query in context.captured_queries:
+            self.assertNotIn('books_book', query['sql'])
+        return response
+
+    def test_responses_have_validators(self):
+        response = self.client.get('/books/1/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn('Last-Modified', response)
+        self.assertIn('max-age=0', response['Cache-Control'])
+
+    def test_matching_etag_gives_not_modified(self):
+        for path in ('/books/', '/books/?ids=1', '/books/1/'):
+            etag = self.client.get(path)['ETag']
+            response = self.assertNoBookQueries(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+
+    def test_unmodified_since_gives_not_modified(self):
+        last_modified = self.client.get('/books/')['Last-Modified']
+        response = self.assertNoBookQueries(
+            '/books/', HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_etags_differ_between_requests_and_catalog_versions(self):
+        etag = self.client.get('/books/?ids=1')['ETag']
+        self.assertNotEqual(self.client.get('/books/?ids=2')['ETag'], etag)
+
+        bump_catalog_version()
+        response = self.client.get('/books/?ids=1', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(BOOK_CACHE_MAX_AGE=600)
+    def test_max_age_is_configurable(self):
+        response = self.client.get('/books/')
+        self.assertIn('max-age=600', response['Cache-Control'])
+
+
+class ResponseCompressionTests(BookTestCase):
+    def setUp(self):
+        super().setUp()
+        for gutenberg_id in range(1, 6):
+            create_book(gutenberg_id, related_count=2)
+
+    def test_responses_are_compressed(self):
+        content = self.client.get('/books/').content
+        response = self.client.get('/books/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertLess(len(response.content), len(content))
+        self.assertEqual(gzip.decompress(response.content), content)
+
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        response = self.client.get(
+            '/books/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_small_or_unaccepted_responses_are_not_compressed(self):
+        for accept_encoding in ('identity', 'gzip;q=0', 'deflate'):
+            response = self.client.get('/books/', HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertNotIn('Content-Encoding', response)
+        with override_settings(COMPRESSION_MIN_SIZE=1000000):
+            response = self.client.get('/books/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_cached_responses_are_compressed_once(self):
+        self.client.get('/books/?ids=1,2', HTTP_ACCEPT_ENCODING='gzip')
+        with mock.patch('books.middleware.compress') as compress:
+            response = self.client.get('/books/?ids=2,1', HTTP_ACCEPT_ENCODING='gzip')
+        compress.assert_not_called()
+        self.assertEqual(
+            json.loads(gzip.decompress(response.content))['count'], 2
+        )
+
+        with mock.patch('books.middleware.compress', wraps=compression.compress) as compress:
+            self.client.get(
+                '/books/?ids=2,1',
+                HTTP_ACCEPT='application/json; indent=2',
+                HTTP_ACCEPT_ENCODING='gzip'
+            )
+        compress.assert_called_once()
+
+    def test_encodings_are_negotiated(self):
+        self.assertEqual(get_accepted_encoding('gzip, deflate, br'), 'gzip')
+        self.assertEqual(get_accepted_encoding('*'), 'gzip')
+        self.assertIsNone(get_accepted_encoding('*;q=0'))
+        self.assertIsNone(get_accepted_encoding(''))
+        with mock.patch.object(compression, 'brotli', object()):
+            self.assertEqual(get_accepted_encoding('gzip, deflate, br'), 'br')
+            self.assertEqual(get_accepted_encoding('br;q=0.5, gzip'), 'gzip')
+
+    @skipIf(compression.brotli is None, 'brotli is not installed.')
+    def test_brotli_is_preferred(self):
+        content = self.client.get('/books/').content
+        response = self.client.get('/books/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(compression.brotli.decompress(response.content), content)
+
+
+@override_settings(REQUEST_METRICS=True)
+class RequestMetricsTests(BookTestCase):
+    def setUp(self):
+        super().setUp()
+        create_book(1)
+
+    def get_metric_value(self, line_start):
+        for line in self.client.get('/metrics').content.decode().splitlines():
+            if line.startswith(line_start):
+                return float(line.split()[-1])
+        return None
+
+    def test_responses_have_server_timing(self):
+        response = self.client.get('/books/?ids=1')
+        server_timing = response['Server-Timing']
+        self.assertRegex(server_timing, r'^db;dur=[0-9.]+;desc="[1-9][0-9]* queries", ')
+        self.assertIn('serialization;dur=', server_timing)
+        self.assertIn('total;dur=', server_timing)
+
+        cached_response = self.client.get('/books/?ids=1')
+        self.assertIn('desc="0 queries"', cached_response['Server-Timing'])
+
+    def test_metrics_are_split_by_filters(self):
+        self.client.get('/books/?languages=en&ids=1')
+        self.client.get('/books/1/')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        metrics = response.content.decode()
+        self.assertIn('# TYPE gutendex_request_duration_seconds histogram', metrics)
+        self.assertIn(
+            'gutendex_request_db_queries_count{filters="ids,languages",'
+            'status="200",view="book-list"}',
+            metrics
+        )
+        self.assertIn(
+            'gutendex_request_serialization_duration_seconds_bucket{'
+            'filters="none",status="200",view="book-detail",le="+Inf"}',
+            metrics
+        )
+
+    def test_serialization_time_excludes_compression(self):
+        def compress_slowly(content, encoding):
+            sleep(0.05)
+            return compression.compress(content, encoding)
+
+        for gutenberg_id in range(2, 12):
+            create_book(gutenberg_id, related_count=2)
+        with mock.patch('books.middleware.compress', side_effect=compress_slowly):
+            response = self.client.get('/books/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        timings = dict(re.findall(r'(\w+);dur=([0-9.]+)', response['Server-Timing']))
+        self.assertLess(float(timings['serialization']), 50)
+        self.assertGreaterEqual(float(timings['total']), 50)
+
+    def test_streamed_queries_are_counted(self):
+        line_start = (
+            'gutendex_request_db_queries_sum{filters="ids",status="200",'
+            'view="book-export"}'
+        )
+        query_sum = self.get_metric_value(line_start)
+
+        response = self.client.get('/books/export.ndjson?ids=1')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.get_metric_value(line_start), query_sum)
+
+        b''.join(response.streaming_content)
+        self.assertGreater(self.get_metric_value(line_start), query_sum or 0)
+
+    @override_settings(REQUEST_METRICS=False)
+    def test_metrics_can_be_disabled(self):
+        self.assertNotIn('Server-Timing', self.client.get('/books/'))
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+
+@override_settings(SLOW_QUERY_THRESHOLD=0.001)
+class SlowQuerySamplingTests(BookTestCase):
+    def setUp(self):
+        super().setUp()
+        for gutenberg_id in range(1, 4):
+            create_book(gutenberg_id)
+
+    def test_signatures_group_equivalent_requests(self):
+        self.client.get('/books/?search=book&languages=1-0')
+        self.client.get('/books/?languages=2-0,3-0&search=other&sort=popular')
+        self.client.get('/books/?topic=shelf&page=1')
+        self.client.get('/books/2/')
+
+        samples = SlowQuerySample.objects.order_by('id')
+        self.assertEqual(
+            [sample.signature for sample in samples],
+            [
+                'list:languages,search;sort=popular',
+                'list:page,topic;sort=popular',
+                'retrieve:none;sort=popular',
+            ]
+        )
+        self.assertEqual(samples[0].parameters, 'search=book&languages=1-0')
+        self.assertEqual(samples[0].plan, '')
+        self.assertIn('books_', samples[0].sql)
+        self.assertNotIn('%s', samples[0].sql)
+
+    def test_serialization_queries_are_sampled(self):
+        recorders = []
+
+        class QueryRecorder(slowqueries.QueryRecorder):
+            def __init__(self):
+                super().__init__()
+                recorders.append(self)
+
+        with mock.patch.object(slowqueries, 'QueryRecorder', QueryRecorder):
+            self.client.get('/books/?ids=1')
+            self.client.get('/books/2/')
+        self.assertEqual(len(recorders), 2)
+        for recorder in recorders:
+            self.assertTrue(any(
+                'books_person' in sql for _, sql, _ in recorder.queries
+            ))
+
+    @override_settings(SLOW_QUERY_THRESHOLD=0)
+    def test_sampling_is_opt_in(self):
+        self.client.get('/books/')
+        self.assertFalse(SlowQuerySample.objects.exists())
+
+    def test_command_lists_worst_signatures(self):
+        self.client.get('/books/?ids=1')
+        self.client.get('/books/?sort=ascending')
+
+        output = StringIO()
+        call_command('slowqueries', '--plans', stdout=output)
+        self.assertIn('list:ids;sort=popular: 1 samples', output.getvalue())
+        self.assertIn('list:none;sort=ascending: 1 samples', output.getvalue())
+        self.assertIn('?ids=1', output.getvalue())
+        self.assertIn('Execution Time', output.getvalue())
+        for sample in SlowQuerySample.objects.all():
+            self.assertIn('Execution Time', sample.plan)
+
+        call_command('slowqueries', '--clear', stdout=StringIO())
+        self.assertFalse(SlowQuerySample.objects.exists())
+
+
+@override_settings(BOOK_DOCUMENTS=True)
+class BookDocumentTests(BookTestCase):
+    def setUp(self):
+        super().setUp()
+        for gutenberg_id in range(1, 6):
+            create_book(gutenberg_id, related_count=2)
+
+    def get_live_data(self, path):
+        with override_settings(BOOK_DOCUMENTS=False):
+            return self.client.get(path).json()
+
+    def test_documents_match_live_responses(self):
+        update_book_documents()
+        for path in ('/books/', '/books/?sort=ascending&ids=2,3', '/books/4/'):
+            live_data = self.get_live_data(path)
+            cache.clear()
+            response = self.client.get(path)
+            self.assertEqual(response.json(), live_data)
+
+    def test_documents_are_read_in_one_query(self):
+        update_book_documents()
+        # This takes one catalog version query, one count query, and one page
+        # query.
+        with self.assertNumQueries(3):
+            self.client.get('/books/')
+
+    def test_documents_are_rendered_without_decoding(self):
+        update_book_documents()
+        with override_settings(BOOK_DOCUMENTS=False):
+            live_content = self.client.get('/books/').content
+        cache.clear()
+        with mock.patch('books.serializers.json.loads') as loads:
+            content = self.client.get('/books/').content
+        loads.assert_not_called()
+        self.assertEqual(content, live_content)
+
+    def test_books_without_documents_are_serialized(self):
+        update_book_documents(Book.objects.filter(gutenberg_id__lte=3))
+        live_data = self.get_live_data('/books/')
+        cache.clear()
+        self.assertEqual(self.client.get('/books/').json(), live_data)
+
+    def test_inconsistent_documents_are_found(self):
+        update_book_documents()
+        self.assertEqual(get_inconsistent_book_ids(), [])
+
+        book = Book.objects.get(gutenberg_id=2)
+        book.title = 'New Title'
+        book.save()
+        BookDocument.objects.filter(book__gutenberg_id=4).delete()
+        self.assertEqual(get_inconsistent_book_ids(), [2, 4])
+
+        with self.assertRaises(CommandError):
+            call_command('checkbookdocuments', stdout=StringIO())
+        call_command('checkbookdocuments', '--fix', stdout=StringIO())
+        self.assertEqual(get_inconsistent_book_ids(), [])
+
+
+class BookJSONRendererTests(TestCase):
+    def get_data(self):
+        return {
+            'books': [
+                JSONFragment('{"id":1,"title":"Caf\u00e9"}'),
+                {'id': 2, 'title': 'Line\u2028separator', 'ratio': Decimal('0.5')},
+            ],
+            'created': datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc),
+            'fragment-like': 'json-fragment-0',
+            'languages': ('en', 'fr'),
+        }
+
+    def test_output_matches_json_renderer(self):
+        data = self.get_data()
+        expected = JSONRenderer().render(dict(
+            data, books=[json.loads(data['books'][0].content), data['books'][1]]
+        ))
+        self.assertIn(b'"title":"Caf\xc3\xa9"', expected)
+        self.assertIn(b'Line\\u2028separator', expected)
+
+        self.assertEqual(BookJSONRenderer().render(data), expected)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(BookJSONRenderer().render(data), expected)
+
+    def test_indented_output_falls_back(self):
+        content = BookJSONRenderer().render(
+            self.get_data(), 'application/json; indent=2'
+        )
+        self.assertIn(b'\n  "books": [\n    {\n      "id": 1,', content)
+
+
+class RDFExtractionTests(TestCase):
+    def get_golden_book(self, id):
+        with open(os.path.join(TEST_BOOKS_DIR, '%d.json' % id)) as file:
+            return json.load(file)
+
+    def get_rdf_path(self, id):
+        return os.path.join(TEST_RDF_DIR, str(id), 'pg%d.rdf' % id)
+
+    def test_extracted_books_match_golden_data(self):
+        for id in TEST_BOOK_IDS:
+            with self.subTest(id=id):
+                self.assertEqual(
+                    extract_book(id, self.get_rdf_path(id)),
+                    self.get_golden_book(id)
+                )
+
+    def test_tree_parser_matches_golden_data(self):
+        for id in TEST_BOOK_IDS:
+            with self.subTest(id=id):
+                book = get_book(id, self.get_rdf_path(id))
+                book['bookshelves'].sort()
+                self.assertEqual(book, self.get_golden_book(id))
+
+    def test_unsafe_and_malformed_xml_is_refused(self):
+        rdf_strings = (
+            '<?xml version="1.0"?><!DOCTYPE r [<!ENTITY a "aaaa">]><r>&a;</r>',
+            '<?xml version="1.0"?><!DOCTYPE r [<!ENTITY a SYSTEM '
+            '"file:///etc/passwd">]><r>&a;</r>',
+            '<rdf:RDF><pgterms:ebook>',
+        )
+        for rdf in rdf_strings:
+            with self.subTest(rdf=rdf):
+                with self.assertRaisesMessage(
+                    Exception, 'The XML file could not be parsed.'
+                ):
+                    extract_book(1, BytesIO(rdf.encode('utf-8')))
+
+    def test_benchmark_command_compares_parsers(self):
+        stdout = StringIO()
+        with override_settings(CATALOG_RDF_DIR=TEST_RDF_DIR):
+            call_command('benchmarkrdfparsing', '--repeat=1', stdout=stdout)
+        self.assertIn('times as fast', stdout.getvalue())
+
+
+@override_settings(CATALOG_RDF_DIR=TEST_RDF_DIR)
+@mock.patch.object(updatecatalog, 'log')
+class CatalogImportTests(BookTestCase):
+    def get_catalog_data(self):
+        books = Book.objects.order_by('gutenberg_id')
+        return [BookSerializer(book).data for book in books]
+
+    def parse_catalog(self):
+        return list(
+            updatecatalog.parse_books(updatecatalog.get_directory_files())
+        )
+
+    def make_archive(self, book_ids=TEST_BOOK_IDS):
+        """ This makes a catalog archive laid out like the real one. """
+
+        temporary_directory = TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        archive_path = os.path.join(temporary_directory.name, 'catalog.tar.bz2')
+        with tarfile.open(archive_path, 'w:bz2') as archive:
+            for id in book_ids:
+                archive.add(
+                    os.path.join(TEST_RDF_DIR, str(id)),
+                    arcname='cache/epub/%d' % id
+                )
+        return archive_path
+
+    def test_parallel_parsing_matches_serial_parsing(self, log):
+        book_files = list(updatecatalog.get_directory_files())
+        serial_books = list(updatecatalog.parse_books(book_files, workers=1))
+        parallel_books = list(updatecatalog.parse_books(book_files, workers=3))
+        self.assertEqual(parallel_books, serial_books)
+        self.assertEqual([book['id'] for book in serial_books], TEST_BOOK_IDS)
+
+    def test_parsing_works_in_spawned_processes(self, log):
+        book_files = list(updatecatalog.get_directory_files())
+        serial_books = list(updatecatalog.parse_books(book_files, workers=1))
+        with mock.patch.object(updatecatalog, 'ProcessPoolExecutor', partial(
+            ProcessPoolExecutor, mp_context=multiprocessing.get_context('spawn')
+        )):
+            spawned_books = list(updatecatalog.parse_books(book_files, workers=2))
+        self.assertEqual(spawned_books, serial_books)
+
+    def test_parallel_import_matches_serial_import(self, log):
+        updatecatalog.put_catalog_in_db(workers=1)
+        serial_data = self.get_catalog_data()
+        Book.objects.all().delete()
+
+        updatecatalog.put_catalog_in_db(workers=2, full=True)
+        self.assertEqual(self.get_catalog_data(), serial_data)
+        self.assertEqual(len(serial_data), len(TEST_BOOK_IDS))
+
+    def test_archive_import_matches_directory_import(self, log):
+        updatecatalog.put_catalog_in_db()
+        directory_data = self.get_catalog_data()
+        Book.objects.all().delete()
+
+        updatecatalog.put_catalog_in_db(
+            workers=2, full=True, archive_path=self.make_archive()
+        )
+        self.assertEqual(self.get_catalog_data(), directory_data)
+
+    def test_archive_import_removes_missing_books(self, log):
+        updatecatalog.put_catalog_in_db()
+        updatecatalog.put_catalog_in_db(archive_path=self.make_archive([84, 5200]))
+        self.assertEqual(
+            list(Book.objects.order_by('gutenberg_id').values_list(
+                'gutenberg_id', flat=True
+            )),
+            [84, 5200]
+        )
+
+    def test_import_stores_parsed_books(self, log):
+        updatecatalog.put_catalog_in_db()
+        data = self.client.get('/books/5200/').json()
+        self.assertEqual(data['title'], 'Metamorphosis')
+        self.assertEqual(
+            data['translators'],
+            [{'name': 'Wyllie, David', 'birth_year': None, 'death_year': None}]
+        )
+        self.assertEqual(data['editors'][0]['name'], 'Example, Editor')
+        self.assertEqual(
+            data['formats'],
+            {'text/plain; charset=utf-8': 'https://www.gutenberg.org/ebooks/5200.txt.utf-8'}
+        )
+        self.assertEqual(
+            self.client.get('/books/?search=shelley').json()['results'][0]['id'],
+            84
+        )
+        self.assertEqual(get_inconsistent_book_ids(), [])
+
+    def test_reimport_keeps_shared_and_unchanged_rows(self, log):
+        updatecatalog.put_catalog_in_db()
+        data = self.get_catalog_data()
+        person_ids = set(Person.objects.values_list('id', flat=True))
+        format_ids = set(Format.objects.values_list('id', flat=True))
+
+        updatecatalog.put_catalog_in_db()
+        self.assertEqual(self.get_catalog_data(), data)
+        self.assertEqual(set(Person.objects.values_list('id', flat=True)), person_ids)
+        self.assertEqual(set(Format.objects.values_list('id', flat=True)), format_ids)
+
+    def test_reimport_replaces_changed_relations(self, log):
+        books = self.parse_catalog()
+        updatecatalog.put_books_in_db(books)
+
+        book = books[1]
+        book['authors'] = [{'name': 'Homer', 'birth': -750, 'death': -650}]
+        book['formats'] = {'text/html': 'https://example.org/1342.html'}
+        book['languages'] = ['fr', 'en', 'fr']
+        book['summaries'] = []
+        updatecatalog.put_books_in_db([book])
+
+        data = self.client.get('/books/1342/').json()
+        self.assertEqual([author['name'] for author in data['authors']], ['Homer'])
+        self.assertEqual(data['formats'], {'text/html': 'https://example.org/1342.html'})
+        self.assertEqual(data['languages'], ['en', 'fr'])
+        self.assertEqual(data['summaries'], [])
+        self.assertEqual(Person.objects.filter(name='Homer').count(), 1)
+
+    def test_import_query_count_does_not_grow_with_books(self, log):
+        books = self.parse_catalog()
+        query_counts = []
+        for chunk in (books[1:3], books):
+            for model in (Book, Bookshelf, Language, Person, Subject):
+                model.objects.all().delete()
+            with CaptureQueriesContext(connection) as context:
+                updatecatalog.put_books_in_db(chunk)
+            query_counts.append(len(context.captured_queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+
+@mock.patch.object(updatecatalog, 'log')
+class BenchmarkTests(BookTestCase):
+    def test_synthetic_catalog_is_reproducible_and_importable(self, log):
+        with TemporaryDirectory() as path, TemporaryDirectory() as other_path:
+            write_synthetic_catalog(path, 40, seed=1)
+            write_synthetic_catalog(other_path, 40, seed=1)
+            with open(os.path.join(path, '7', 'pg7.rdf')) as file:
+                rdf = file.read()
+            with open(os.path.join(other_path, '7', 'pg7.rdf')) as file:
+                self.assertEqual(file.read(), rdf)
+
+            with override_settings(CATALOG_RDF_DIR=path):
+                updatecatalog.put_catalog_in_db()
+        self.assertEqual(Book.objects.count(), 40)
+        self.assertFalse(QuarantinedBook.objects.exists())
+        self.assertTrue(Book.objects.filter(authors__isnull=False).exists())
+
+    def test_api_benchmarks_time_each_request(self, log):
+        for id in range(1, 41):
+            create_book(id)
+
+        results = run_api_benchmarks(repeat=2)
+        self.assertIn('deep_cursor', results)
+        for name, result in results.items():
+            with self.subTest(name=name):
+                self.assertEqual(result['status'], 200)
+                self.assertGreater(result['queries'], 0)
+                self.assertLessEqual(
+                    result['uncached_ms']['p50'], result['uncached_ms']['max']
+                )
+
+
+class LookupCacheTests(TestCase):
+    def setUp(self):
+        for name in ('Fiction', 'History', 'Poetry'):
+            Subject.objects.create(name=name)
+
+    def test_preloaded_ids_are_used_without_queries(self):
+        lookup_cache = updatecatalog.LookupCache(Subject)
+        with self.assertNumQueries(1):
+            lookup_cache.preload()
+
+        with self.assertNumQueries(2):
+            ids = lookup_cache.get_ids({('Fiction',), ('Drama',)})
+        self.assertEqual(ids[('Fiction',)], Subject.objects.get(name='Fiction').id)
+        self.assertEqual(ids[('Drama',)], Subject.objects.get(name='Drama').id)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(lookup_cache.get_ids({('Drama',)}), {
+                ('Drama',): ids[('Drama',)]
+            })
+        self.assertEqual((lookup_cache.hits, lookup_cache.misses), (2, 1))
+        self.assertTrue(str(lookup_cache).startswith('subject: 2 hits and 1 misses'))
+
+    def test_least_recently_used_ids_are_dropped(self):
+        lookup_cache = updatecatalog.LookupCache(Subject, size=2)
+        lookup_cache.preload()
+        self.assertEqual(list(lookup_cache.ids), [('History',), ('Poetry',)])
+
+        lookup_cache.get_ids({('History',)})
+        lookup_cache.get_ids({('Fiction',)})
+        self.assertEqual(list(lookup_cache.ids), [('History',), ('Fiction',)])
+
+    def test_ids_made_in_failed_transactions_are_forgotten(self):
+        lookup_cache = updatecatalog.LookupCache(Subject)
+        lookup_cache.begin()
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                lookup_cache.get_ids({('Drama',)})
+                raise RuntimeError
+        lookup_cache.roll_back()
+
+        self.assertNotIn(('Drama',), lookup_cache.ids)
+        drama_id = lookup_cache.get_ids({('Drama',)})[('Drama',)]
+        self.assertEqual(Subject.objects.get(name='Drama').id, drama_id)
+
+
+class CatalogCopyTestCase(BookTestCase):
+    """ This imports from a copy of the test catalog that tests can change. """
+
+    def setUp(self):
+        super().setUp()
+        temporary_directory = TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.rdf_dir = os.path.join(temporary_directory.name, 'rdf')
+        shutil.copytree(TEST_RDF_DIR, self.rdf_dir)
+
+        settings_override = override_settings(CATALOG_RDF_DIR=self.rdf_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def put_catalog_in_db(self, **kwargs):
+        """ This gives the IDs of the books that were parsed. """
+
+        with mock.patch.object(
+            utils, 'parse_book', wraps=utils.parse_book
+        ) as parse_book:
+            updatecatalog.put_catalog_in_db(**kwargs)
+        return [call.args[0] for call in parse_book.call_args_list]
+
+    def replace_rdf_text(self, id, old_text, new_text):
+        path = os.path.join(self.rdf_dir, str(id), 'pg%d.rdf' % id)
+        with open(path) as file:
+            rdf = file.read()
+        with open(path, 'w') as file:
+            file.write(rdf.replace(old_text, new_text))
+
+
+@mock.patch.object(updatecatalog, 'log')
+class IncrementalCatalogImportTests(CatalogCopyTestCase):
+    def test_only_new_and_changed_books_are_imported(self, log):
+        self.assertEqual(self.put_catalog_in_db(), TEST_BOOK_IDS)
+        self.assertEqual(self.put_catalog_in_db(), [])
+
+        self.replace_rdf_text(5200, 'Metamorphosis', 'The Metamorphosis')
+        self.assertEqual(self.put_catalog_in_db(), [5200])
+        self.assertEqual(
+            Book.objects.get(gutenberg_id=5200).title, 'The Metamorphosis'
+        )
+
+    def test_removed_books_are_deleted(self, log):
+        self.put_catalog_in_db()
+        shutil.rmtree(os.path.join(self.rdf_dir, '84'))
+
+        self.assertEqual(self.put_catalog_in_db(), [])
+        self.assertFalse(Book.objects.filter(gutenberg_id=84).exists())
+        self.assertFalse(CatalogFile.objects.filter(gutenberg_id=84).exists())
+
+    def test_full_import_parses_every_book(self, log):
+        self.put_catalog_in_db()
+        self.assertEqual(self.put_catalog_in_db(full=True), TEST_BOOK_IDS)
+
+    def test_bad_books_are_quarantined(self, log):
+        self.replace_rdf_text(84, '</rdf:RDF>', '')
+        self.replace_rdf_text(5200, '>en<', '>english<')
+
+        self.put_catalog_in_db()
+        self.assertEqual(
+            sorted(Book.objects.values_list('gutenberg_id', flat=True)),
+            [1342, 90001]
+        )
+        self.assertEqual(
+            sorted(QuarantinedBook.objects.values_list('gutenberg_id', flat=True)),
+            [84, 5200]
+        )
+        self.assertIn(
+            'could not be parsed',
+            QuarantinedBook.objects.get(gutenberg_id=84).error
+        )
+
+        self.replace_rdf_text(5200, '>english<', '>en<')
+        self.assertEqual(self.put_catalog_in_db(), [84, 5200])
+        self.assertEqual(
+            list(QuarantinedBook.objects.values_list('gutenberg_id', flat=True)),
+            [84]
+        )
+        self.assertTrue(Book.objects.filter(gutenberg_id=5200).exists())
+
+    @mock.patch.object(updatecatalog, 'IMPORT_CHUNK_SIZE', 1)
+    def test_interrupted_import_resumes_after_checkpoint(self, log):
+        put_chunk_in_db = updatecatalog.put_chunk_in_db
+        chunk_ids = []
+
+        def put_chunk_in_db_until_interrupted(chunk, *args):
+            if len(chunk_ids) == 2:
+                raise KeyboardInterrupt
+            chunk_ids.append(chunk[0]['id'])
+            return put_chunk_in_db(chunk, *args)
+
+        with mock.patch.object(
+            updatecatalog,
+            'put_chunk_in_db',
+            side_effect=put_chunk_in_db_until_interrupted
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                updatecatalog.put_catalog_in_db(full=True)
+        self.assertEqual(chunk_ids, TEST_BOOK_IDS[:2])
+        self.assertEqual(
+            updatecatalog.get_catalog_checkpoint().gutenberg_id,
+            TEST_BOOK_IDS[1]
+        )
+
+        self.assertEqual(self.put_catalog_in_db(full=True), TEST_BOOK_IDS[2:])
+        self.assertEqual(Book.objects.count(), len(TEST_BOOK_IDS))
+        self.assertFalse(CatalogCheckpoint.objects.exists())
+
+    @mock.patch.object(updatecatalog, 'IMPORT_CHUNK_SIZE', 1)
+    def test_interrupted_command_can_restart(self, log):
+        temporary_directory = TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        temp_path = os.path.join(temporary_directory.name, 'tmp')
+        archive_path = os.path.join(temporary_directory.name, 'catalog.tar.bz2')
+        with tarfile.open(archive_path, 'w:bz2') as archive:
+            for id in TEST_BOOK_IDS:
+                archive.add(
+                    os.path.join(self.rdf_dir, str(id)),
+                    arcname='cache/epub/%d' % id
+                )
+
+        put_chunk_in_db = updatecatalog.put_chunk_in_db
+        chunk_count = 0
+
+        def put_chunk_in_db_until_interrupted(*args):
+            nonlocal chunk_count
+            if chunk_count == 2:
+                raise RuntimeError('Interrupted')
+            chunk_count += 1
+            return put_chunk_in_db(*args)
+
+        command = updatecatalog.Command()
+        options = {
+            'archive': archive_path,
+            'full': False,
+            'restart': False,
+            'staged': False,
+            'stream': True,
+            'workers': 1,
+        }
+        with mock.patch.object(updatecatalog, 'TEMP_PATH', temp_path):
+            with mock.patch.object(
+                updatecatalog,
+                'put_chunk_in_db',
+                side_effect=put_chunk_in_db_until_interrupted
+            ):
+                command.handle(**options)
+            self.assertEqual(Book.objects.count(), 2)
+            self.assertTrue(os.path.exists(temp_path))
+
+            command.handle(**dict(options, restart=True))
+        self.assertEqual(Book.objects.count(), len(TEST_BOOK_IDS))
+        self.assertFalse(CatalogCheckpoint.objects.exists())
+        self.assertFalse(os.path.exists(temp_path))
+
+    def test_checkpoints_of_other_catalogs_are_ignored(self, log):
+        CatalogCheckpoint.objects.create(
+            id=1, catalog_version=0, gutenberg_id=1342, position=2
+        )
+        bump_catalog_version()
+        self.assertEqual(self.put_catalog_in_db(), TEST_BOOK_IDS)
+
+        CatalogCheckpoint.objects.create(
+            id=1,
+            catalog_version=updatecatalog.get_latest_catalog_version_id(),
+            gutenberg_id=84,
+            position=2
+        )
+        self.assertEqual(self.put_catalog_in_db(full=True), TEST_BOOK_IDS)
+
+
+@mock.patch.object(updatecatalog, 'log')
+class StagedCatalogImportTests(CatalogCopyTestCase):
+    def setUp(self):
+        super().setUp()
+        # Tables with deferred constraint checks pending can't be altered, and
+        # tests run in a transaction that would otherwise leave them pending.
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+    def test_staged_catalog_is_swapped_in_at_once(self, log):
+        self.put_catalog_in_db()
+        self.replace_rdf_text(5200, 'Metamorphosis', 'The Metamorphosis')
+        shutil.rmtree(os.path.join(self.rdf_dir, '84'))
+
+        self.assertTrue(create_staging_tables())
+        self.assertFalse(create_staging_tables())
+        with use_staging_tables():
+            self.assertEqual(self.put_catalog_in_db(), [5200])
+
+        self.assertEqual(
+            self.client.get('/books/5200/').json()['title'], 'Metamorphosis'
+        )
+        self.assertEqual(self.client.get('/books/84/').status_code, 200)
+
+        finish_staging_tables()
+        swap_staging_tables()
+        bump_catalog_version()
+
+        self.assertFalse(staging_tables_exist())
+        self.assertEqual(
+            self.client.get('/books/5200/').json()['title'], 'The Metamorphosis'
+        )
+        self.assertEqual(self.client.get('/books/84/').status_code, 404)
+        self.assertEqual(
+            [
+                book['id'] for book in
+                self.client.get('/books/?search=metamorph').json()['results']
+            ],
+            [5200]
+        )
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Book._meta.db_table
+            )
+        self.assertIn('books_book_popular_idx', constraints)
+
+        new_book = create_book(100)
+        self.assertGreater(new_book.id, Book.objects.exclude(id=new_book.id).aggregate(
+            id=Max('id')
+        )['id'])
+
+    def test_staging_tables_can_be_finished_again(self, log):
+        self.put_catalog_in_db()
+        create_staging_tables()
+        finish_staging_tables()
+        # An import whose swap failed leaves the indexes for the next run.
+        finish_staging_tables()
+        swap_staging_tables()
+
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Book._meta.db_table
+            )
+        self.assertIn('books_book_popular_idx', constraints)
+        self.assertEqual(Book.objects.count(), len(TEST_BOOK_IDS))
+
+    def test_staging_tables_start_as_copies_of_live_tables(self, log):
+        self.put_catalog_in_db()
+        live_data = [BookSerializer(book).data for book in Book.objects.all()]
+
+        create_staging_tables()
+        with use_staging_tables():
+            self.assertEqual(
+                [BookSerializer(book).data for book in Book.objects.all()],
+                live_data
+            )
+            self.assertEqual(self.put_catalog_in_db(), [])
+            Person.objects.create(name='Staged, Person')
+            Book.objects.all().delete()
+
+        self.assertEqual(Book.objects.count(), len(TEST_BOOK_IDS))
+        self.assertFalse(Person.objects.filter(name='Staged, Person').exists())
+        drop_staging_tables()
+        self.assertFalse(staging_tables_exist())
@@ -1,5 +1,11 @@
+from defusedxml import (
+    DefusedXmlException, EntitiesForbidden, ExternalReferenceForbidden
+)
 import defusedxml.ElementTree as parser
+from hashlib import sha256
+from io import BytesIO
 import re
+from xml.parsers import expat
 
 
 LINE_BREAK_PATTERN = re.compile(r'[ \t]*[\n\r]+[ \t]*')
@@ -11,6 +17,51 @@ NAMESPACES = {
     'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
 }
 
+# These are the names that expat gives elements and attributes, which are the
+# namespace and local name separated by a space.
+TAGS = {
+    name: '%s %s' % (NAMESPACES[prefix], local_name)
+    for name, (prefix, local_name) in {
+        'about': ('rdf', 'about'),
+        'birthdate': ('pg', 'birthdate'),
+        'bookshelf': ('pg', 'bookshelf'),
+        'creator': ('dc', 'creator'),
+        'deathdate': ('pg', 'deathdate'),
+        'downloads': ('pg', 'downloads'),
+        'ebook': ('pg', 'ebook'),
+        'editor': ('marcrel', 'edt'),
+        'file': ('pg', 'file'),
+        'format': ('dc', 'format'),
+        'language': ('dc', 'language'),
+        'member_of': ('dcam', 'memberOf'),
+        'name': ('pg', 'name'),
+        'resource': ('rdf', 'resource'),
+        'rights': ('dc', 'rights'),
+        'subject': ('dc', 'subject'),
+        'summary': ('pg', 'marc520'),
+        'title': ('dc', 'title'),
+        'translator': ('marcrel', 'trl'),
+        'type': ('dc', 'type'),
+        'value': ('rdf', 'value'),
+    }.items()
+}
+LCSH = '%(dc)sLCSH' % NAMESPACES
+
+# These are the kinds of elements whose descendants `BookExtractor` gathers
+# values from.
+CONTAINER_KINDS = {
+    TAGS['bookshelf']: 'bookshelf',
+    TAGS['creator']: 'authors',
+    TAGS['editor']: 'editors',
+    TAGS['file']: 'file',
+    TAGS['language']: 'language',
+    TAGS['subject']: 'subject',
+    TAGS['translator']: 'translators',
+    TAGS['type']: 'type',
+}
+PERSON_KINDS = ('authors', 'editors', 'translators')
+PERSON_TAGS = (TAGS['birthdate'], TAGS['deathdate'], TAGS['name'])
+
 
 def fix_subtitles(title):
     """
@@ -27,6 +78,16 @@ def fix_subtitles(title):
     return LINE_BREAK_PATTERN.sub('; ', new_title)
 
 
+def get_digest(contents):
+    """ This gives a SHA-256 digest of the contents of a file. """
+
+    return sha256(contents).hexdigest()
+
+
+def get_error_message(error):
+    return '%s: %s' % (error.__class__.__name__, error)
+
+
 def get_book(id, xml_file_path):
     """ Based on https://gist.github.com/andreasvc/b3b4189120d84dec8857 """
 
@@ -150,6 +211,215 @@ def get_book(id, xml_file_path):
     return result
 
 
+def extract_book(id, xml_file):
+    """
+    This gives the same data as `get_book` (with sorted bookshelves) from an
+    RDF file path or binary file. Rather than building a tree and searching it
+    many times, it gathers everything in one pass of expat's parsing events,
+    refusing the same XML as defusedxml does by default.
+    """
+
+    extractor = BookExtractor()
+    xml_parser = expat.ParserCreate(namespace_separator=' ')
+    xml_parser.buffer_text = True
+    xml_parser.StartElementHandler = extractor.start
+    xml_parser.EndElementHandler = extractor.end
+    xml_parser.CharacterDataHandler = extractor.data
+    xml_parser.EntityDeclHandler = forbid_entity_declaration
+    xml_parser.UnparsedEntityDeclHandler = forbid_unparsed_entity_declaration
+    xml_parser.ExternalEntityRefHandler = forbid_external_entity_reference
+
+    try:
+        if isinstance(xml_file, str):
+            with open(xml_file, 'rb') as file:
+                xml_parser.ParseFile(file)
+        else:
+            xml_parser.ParseFile(xml_file)
+    except (DefusedXmlException, expat.ExpatError):
+        raise Exception('The XML file could not be parsed.')
+
+    return extractor.get_book(id)
+
+
+class BookExtractor:
+    """ This gathers book data from parsing events for `extract_book`. """
+
+    def __init__(self):
+        # These are the elements of the kinds in `CONTAINER_KINDS` (along with
+        # formats of files) that the parser is in, from the outside in.
+        self.containers = []
+        self.depth = 0
+        self.found_ebook = False
+        self.in_ebook = False
+        self.text_parts = []
+
+        self.bookshelves = set()
+        self.book_type = None
+        self.downloads = None
+        self.files = []
+        self.languages = []
+        self.people = []
+        self.rights = None
+        self.subjects = set()
+        self.summaries = []
+        self.title = None
+
+    def start(self, tag, attributes):
+        self.depth += 1
+        self.text_parts = []
+
+        if not self.in_ebook:
+            if self.depth == 2 and tag == TAGS['ebook'] and not self.found_ebook:
+                self.in_ebook = self.found_ebook = True
+            return
+
+        containers = self.containers
+        kind = CONTAINER_KINDS.get(tag)
+        if (
+            tag == TAGS['format']
+            and containers
+            and containers[-1]['kind'] == 'file'
+            and containers[-1]['depth'] == self.depth - 1
+        ):
+            kind = 'file_format'
+
+        if kind is not None:
+            container = {'depth': self.depth, 'kind': kind, 'values': []}
+            containers.append(container)
+            if kind == 'file':
+                container['url'] = attributes.get(TAGS['about'])
+                self.files.append(container)
+            elif kind in PERSON_KINDS:
+                self.people.append(container)
+        elif tag == TAGS['member_of']:
+            for container in containers:
+                if container['kind'] == 'subject':
+                    container.setdefault(
+                        'member_of', attributes.get(TAGS['resource'])
+                    )
+
+    def data(self, text):
+        self.text_parts.append(text)
+
+    def end(self, tag):
+        depth = self.depth
+        self.depth -= 1
+
+        if not self.in_ebook:
+            return
+        if depth == 2:
+            self.in_ebook = False
+            return
+
+        # Like `Element.text` for elements without children, this is `None`
+        # for empty elements.
+        text = ''.join(self.text_parts) or None
+        self.text_parts = []
+
+        containers = self.containers
+        if tag == TAGS['value']:
+            for container in containers:
+                container['values'].append(text)
+        elif tag in PERSON_TAGS:
+            for container in containers:
+                container.setdefault(tag, text)
+        elif tag == TAGS['title']:
+            if self.title is None and text is not None:
+                self.title = fix_subtitles(text)
+        elif tag == TAGS['rights']:
+            if self.rights is None:
+                self.rights = text or ''
+        elif tag == TAGS['downloads']:
+            if self.downloads is None:
+                self.downloads = int(text)
+        elif tag == TAGS['summary']:
+            self.summaries.append(text)
+
+        if containers and containers[-1]['depth'] == depth:
+            container = containers.pop()
+            kind = container['kind']
+            values = container['values']
+            if kind == 'bookshelf':
+                if values:
+                    self.bookshelves.add(values[0])
+            elif kind == 'file_format':
+                if values:
+                    containers[-1].setdefault('content_type', values[0])
+            elif kind == 'language':
+                self.languages += values
+            elif kind == 'subject':
+                subject_type = container.get('member_of')
+                if values and subject_type is not None and subject_type in LCSH:
+                    self.subjects.add(values[0])
+            elif kind == 'type':
+                if values and self.book_type is None:
+                    self.book_type = values[0]
+
+    def get_book(self, id):
+        if not self.found_ebook:
+            raise Exception('The XML file does not describe a book.')
+
+        result = {
+            'id': int(id),
+            'title': self.title,
+            'authors': [],
+            'summaries': self.summaries,
+            'editors': [],
+            'translators': [],
+            'type': 'Text' if self.book_type is None else self.book_type,
+            'subjects': sorted(self.subjects),
+            'languages': self.languages,
+            'formats': {},
+            'downloads': self.downloads,
+            'bookshelves': sorted(self.bookshelves),
+            'copyright': None
+        }
+
+        for person in self.people:
+            if person.get(TAGS['name']) is None:
+                continue
+            birth = person.get(TAGS['birthdate'])
+            death = person.get(TAGS['deathdate'])
+            result[person['kind']].append({
+                'birth': None if birth is None else int(birth),
+                'death': None if death is None else int(death),
+                'name': person[TAGS['name']],
+            })
+
+        # Formats (preferring image URLs to `noimages` URLs)
+        for file in self.files:
+            content_type = file.get('content_type')
+            if content_type is None:
+                continue
+            if (
+                content_type not in result['formats']
+                or 'noimages' in result['formats'][content_type]
+            ):
+                result['formats'][content_type] = file['url']
+
+        if self.rights is not None:
+            if self.rights.startswith('Public domain in the USA.'):
+                result['copyright'] = False
+            elif self.rights.startswith('Copyrighted.'):
+                result['copyright'] = True
+
+        return result
+
+
+def forbid_entity_declaration(name, is_parameter_entity, value, base, system_id,
+                              public_id, notation_name):
+    raise EntitiesForbidden(name, value, base, system_id, public_id, notation_name)
+
+
+def forbid_external_entity_reference(context, base, system_id, public_id):
+    raise ExternalReferenceForbidden(context, base, system_id, public_id)
+
+
+def forbid_unparsed_entity_declaration(name, base, system_id, public_id,
+                                       notation_name):
+    raise EntitiesForbidden(name, None, base, system_id, public_id, notation_name)
+
+
 def get_person(person_element):
     name = person_element.find('.//{%(pg)s}name' % NAMESPACES)
 
@@ -175,6 +445,19 @@ def get_person(person_element):
     return person
 
 
+def parse_book(id, contents):
+    """
+    This parses an RDF file. If that fails, it gives the book ID with an error
+    message instead, so that one bad file doesn't stop an import.
+    """
+
+    try:
+        return extract_book(id, BytesIO(contents))
+    except Exception as error:
+        return {'id': id, 'error': get_error_message(error)}
+
+
 def safe_unicode(arg, *args, **kwargs):
     """ Coerce argument to Unicode if it's not already. """
     return arg if isinstance(arg, str) else str(arg, *args, **kwargs)
+
@@ -1,9 +1,28 @@
-from django.db.models import Q
+from hashlib import sha1
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchRank
+from django.core.cache import cache
+from django.db.models import Exists, F, OuterRef, Q
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 
 from rest_framework import exceptions as drf_exceptions, viewsets
+from rest_framework.response import Response
 
+from .cache import get_cache_key, get_catalog_version
+from .metrics import get_metrics_text, measure_serialization
 from .models import *
+from .pagination import BookPagination
+from .renderers import NDJSONRenderer
+from .parameters import (
+    get_fields_parameter, get_filter_parameters, get_sort_parameter
+)
+from .search import get_search_query
 from .serializers import *
+from .slowqueries import sample_slow_queries
 
 
 class BookViewSet(viewsets.ModelViewSet):
@@ -14,12 +33,158 @@ class BookViewSet(viewsets.ModelViewSet):
     queryset = Book.objects.exclude(download_count__isnull=True)
     queryset = queryset.exclude(title__isnull=True)
 
+    pagination_class = BookPagination
     serializer_class = BookSerializer
 
+    export_chunk_size = 1000
+
+    def export(self, request, *args, **kwargs):
+        """
+        This streams every book that the list filters select, in order of
+        Project Gutenberg ID, as newline-delimited JSON. Books are read from a
+        server-side cursor a chunk at a time, so memory use doesn't grow with
+        the catalog.
+        """
+
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = queryset.order_by('gutenberg_id')
+        return StreamingHttpResponse(
+            self.get_export_lines(queryset),
+            content_type='application/x-ndjson'
+        )
+
+    def get_export_lines(self, queryset):
+        renderer = NDJSONRenderer()
+        books = queryset.iterator(chunk_size=self.export_chunk_size)
+        while True:
+            chunk = list(islice(books, self.export_chunk_size))
+            if not chunk:
+                break
+            yield b''.join(
+                renderer.render(book)
+                for book in self.get_serializer(chunk, many=True).data
+            )
+
+    def get_renderers(self):
+        # The export is newline-delimited JSON, including any error response.
+        if self.action == 'export':
+            return [NDJSONRenderer()]
+        return super().get_renderers()
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            self.get_list_response, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            self.get_detail_response, request, *args, **kwargs
+        )
+
+    def get_detail_response(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.get_object())
+        with measure_serialization(request):
+            data = serializer.data
+        return Response(data)
+
+    def get_list_response(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            serializer = self.get_serializer(queryset, many=True)
+            with measure_serialization(request):
+                data = serializer.data
+            return Response(data)
+
+        serializer = self.get_serializer(page, many=True)
+        with measure_serialization(request):
+            data = serializer.data
+        return self.get_paginated_response(data)
+
+    def get_cached_response(self, get_response, request, *args, **kwargs):
+        """
+        This gives a response from the cache if an equivalent request was made
+        since the last catalog update, or else caches a new one. A "304 Not
+        Modified" response is given without any book query if the client
+        already has the current version.
+        """
+
+        cache_key = get_cache_key('response', self.get_response_parameters())
+        etag = quote_etag(sha1(cache_key.encode('utf-8')).hexdigest())
+        catalog_version = get_catalog_version()
+        last_modified = None
+        if catalog_version.created is not None:
+            last_modified = int(catalog_version.created.timestamp())
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is not None:
+            return self.add_caching_headers(response, etag, last_modified)
+
+        timeout = settings.BOOK_RESPONSE_CACHE_TIMEOUT
+        data = cache.get(cache_key) if timeout else None
+        if data is not None:
+            response = Response(data)
+        else:
+            with sample_slow_queries(request, self.action):
+                response = get_response(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            if timeout:
+                cache.set(cache_key, response.data, timeout)
+
+        # Compressed content is cached too, unless the client asked for a
+        # variant of the media type (e.g. indented JSON).
+        media_type = request.accepted_renderer.media_type
+        if timeout and request.accepted_media_type == media_type:
+            response.compressed_content_cache_key = cache_key
+        return self.add_caching_headers(response, etag, last_modified)
+
+    def add_caching_headers(self, response, etag, last_modified):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(
+            response, max_age=settings.BOOK_CACHE_MAX_AGE, public=True
+        )
+        return response
+
+    def get_response_parameters(self):
+        """ This gives everything that a response's contents depend on. """
+
+        query_params = self.request.query_params
+        parameters = get_filter_parameters(query_params)
+        parameters.update({
+            'action': self.action,
+            'kwargs': self.kwargs,
+            'sort': get_sort_parameter(query_params),
+            # Pagination links are absolute URLs.
+            'url': self.request.build_absolute_uri(self.request.path),
+        })
+        for name in ('cursor', 'page'):
+            if name in query_params:
+                parameters[name] = query_params[name]
+        fields = self.get_fields()
+        if fields is not None:
+            parameters['fields'] = fields
+        return parameters
+
+    def get_fields(self):
+        """
+        This gives the names of the book fields that the request selects, or
+        `None` for all of them.
+        """
+
+        return get_fields_parameter(
+            self.request.query_params, BookSerializer.Meta.fields
+        )
+
     def get_queryset(self):
         queryset = self.queryset
+        parameters = get_filter_parameters(self.request.GET)
 
-        sort = self.request.GET.get('sort')
+        sort = get_sort_parameter(self.request.GET)
         if sort == 'ascending':
             queryset = queryset.order_by('id')
         elif sort == 'descending':
@@ -27,75 +192,102 @@ class BookViewSet(viewsets.ModelViewSet):
         else:
             queryset = queryset.order_by('-download_count')
 
-        author_year_end = self.request.GET.get('author_year_end')
-        try:
-            author_year_end = int(author_year_end)
-        except:
-            author_year_end = None
+        author_year_end = parameters.get('author_year_end')
         if author_year_end is not None:
-            queryset = queryset.filter(
-                Q(authors__birth_year__lte=author_year_end) |
-                Q(authors__death_year__lte=author_year_end)
-            )
+            queryset = queryset.filter(Exists(Person.objects.filter(
+                Q(birth_year__lte=author_year_end) |
+                Q(death_year__lte=author_year_end),
+                book=OuterRef('pk')
+            )))
 
-        author_year_start = self.request.GET.get('author_year_start')
-        try:
-            author_year_start = int(author_year_start)
-        except:
-            author_year_start = None
+        author_year_start = parameters.get('author_year_start')
         if author_year_start is not None:
-            queryset = queryset.filter(
-                Q(authors__birth_year__gte=author_year_start) |
-                Q(authors__death_year__gte=author_year_start)
-            )
+            queryset = queryset.filter(Exists(Person.objects.filter(
+                Q(birth_year__gte=author_year_start) |
+                Q(death_year__gte=author_year_start),
+                book=OuterRef('pk')
+            )))
 
-        copyright_parameter = self.request.GET.get('copyright')
-        if copyright_parameter is not None:
-            copyright_strings = copyright_parameter.split(',')
-            copyright_values = set()
-            for copyright_string in copyright_strings:
-                if copyright_string == 'true':
-                    copyright_values.add(True)
-                elif copyright_string == 'false':
-                    copyright_values.add(False)
-                elif copyright_string == 'null':
-                    copyright_values.add(None)
-            for value in [True, False, None]:
-                if value not in copyright_values:
+        copyright_strings = parameters.get('copyright')
+        if copyright_strings is not None:
+            for value, string in [(True, 'true'), (False, 'false'), (None, 'null')]:
+                if string not in copyright_strings:
                     queryset = queryset.exclude(copyright=value)
 
-        id_string = self.request.GET.get('ids')
-        if id_string is not None:
-            ids = id_string.split(',')
+        ids = parameters.get('ids')
+        if ids is not None:
+            queryset = queryset.filter(gutenberg_id__in=ids)
 
-            try:
-                ids = [int(id) for id in ids]
-            except ValueError:
-                pass
-            else:
-                queryset = queryset.filter(gutenberg_id__in=ids)
+        language_codes = parameters.get('languages')
+        if language_codes is not None:
+            queryset = queryset.filter(Exists(Language.objects.filter(
+                book=OuterRef('pk'), code__in=language_codes
+            )))
 
-        language_string = self.request.GET.get('languages')
-        if language_string is not None:
-            language_codes = [code.lower() for code in language_string.split(',')]
-            queryset = queryset.filter(languages__code__in=language_codes)
-
-        mime_type = self.request.GET.get('mime_type')
+        mime_type = parameters.get('mime_type')
         if mime_type is not None:
-            queryset = queryset.filter(format__mime_type__startswith=mime_type)
+            queryset = queryset.filter(Exists(Format.objects.filter(
+                book=OuterRef('pk'), mime_type__startswith=mime_type
+            )))
 
-        search_string = self.request.GET.get('search')
-        if search_string is not None:
-            search_terms = search_string.split(' ')
-            for term in search_terms[:32]:
-                queryset = queryset.filter(
-                    Q(authors__name__icontains=term) | Q(title__icontains=term)
-                )
+        search_terms = parameters.get('search')
+        if search_terms is not None:
+            # Terms shorter than three characters have no trigrams, so the
+            # search text's index can't narrow them down and every book is
+            # checked.
+            for term in search_terms:
+                queryset = queryset.filter(search_text__icontains=term)
+            if sort == 'relevance':
+                search_query = get_search_query(search_terms)
+                queryset = queryset.annotate(
+                    search_rank=SearchRank(F('search_vector'), search_query)
+                ).order_by('-search_rank', '-download_count')
 
-        topic = self.request.GET.get('topic')
+        topic = parameters.get('topic')
         if topic is not None:
             queryset = queryset.filter(
-                Q(bookshelves__name__icontains=topic) | Q(subjects__name__icontains=topic)
+                Exists(Bookshelf.objects.filter(
+                    book=OuterRef('pk'), name__icontains=topic
+                )) |
+                Exists(Subject.objects.filter(
+                    book=OuterRef('pk'), name__icontains=topic
+                ))
             )
 
-        return queryset.distinct()
+        # Relational filters are `EXISTS` subqueries, so rows are never
+        # repeated and `DISTINCT` isn't needed.
+        if settings.BOOK_DOCUMENTS:
+            return queryset.select_related('document')
+        # These are loaded in one query each for a whole page of books, and
+        # only for the fields that were selected.
+        fields = self.get_fields()
+        if fields is None:
+            return queryset.prefetch_related(*BOOK_RELATIONS)
+        return queryset.prefetch_related(*[
+            BOOK_FIELD_RELATIONS[name]
+            for name in fields if name in BOOK_FIELD_RELATIONS
+        ])
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_serializer_class(self):
+        if settings.BOOK_DOCUMENTS:
+            return BookDocumentSerializer
+        if settings.BOOK_FAST_SERIALIZER:
+            return FastBookSerializer
+        return BookSerializer
+
+
+def metrics(request):
+    """
+    This gives the request histograms in the Prometheus text format, if
+    request metrics are enabled.
+    """
+
+    if not settings.REQUEST_METRICS:
+        raise Http404()
+    return HttpResponse(
+        get_metrics_text(), content_type='text/plain; version=0.0.4'
+    )
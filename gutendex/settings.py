@@ -19,9 +19,22 @@ env = environ.Env(
     ADMIN_EMAILS=(list, []),
     ADMIN_NAMES=(list, []),
     ALLOWED_HOSTS=(list, []),
+    BOOK_CACHE_MAX_AGE=(int, 0),
+    BOOK_COUNT_CACHE_TIMEOUT=(int, 86400),
+    BOOK_COUNT_ESTIMATE_THRESHOLD=(int, 0),
+    BOOK_DOCUMENTS=(bool, False),
+    BOOK_FAST_SERIALIZER=(bool, False),
+    BOOK_RESPONSE_CACHE_TIMEOUT=(int, 3600),
+    CACHE_URL=(str, 'locmemcache://'),
+    CATALOG_VERSION_CACHE_TIMEOUT=(int, 10),
+    COMPRESSION_MIN_SIZE=(int, 200),
     DEBUG=(bool, False),
     MANAGER_EMAILS=(list, []),
     MANAGER_NAMES=(list, []),
+    REQUEST_METRICS=(bool, False),
+    RESPONSE_COMPRESSION=(bool, True),
+    SLOW_QUERY_SAMPLE_INTERVAL=(int, 300),
+    SLOW_QUERY_THRESHOLD=(int, 0),
 )
 environ.Env.read_env()
 
@@ -52,6 +65,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     # Other third-party apps
     'corsheaders',
@@ -62,6 +76,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'books.middleware.RequestMetricsMiddleware',
+    'books.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -186,14 +202,67 @@ CATALOG_LOG_DIR = os.path.join(BASE_CATALOG_DIR, 'log')
 CATALOG_TEMP_DIR = os.path.join(BASE_CATALOG_DIR, 'tmp')
 
 
+# Caching of book data, which is invalidated when the catalog is updated
+# `CACHE_URL` can select another backend, e.g. `filecache:///var/tmp/gutendex`
+# or `dbcache://gutendex_cache` (after running `manage.py createcachetable`).
+CACHES = {
+    'default': env.cache_url('CACHE_URL'),
+}
+BOOK_COUNT_CACHE_TIMEOUT = env('BOOK_COUNT_CACHE_TIMEOUT')
+BOOK_RESPONSE_CACHE_TIMEOUT = env('BOOK_RESPONSE_CACHE_TIMEOUT')
+
+# This is the `max-age` that book responses give to HTTP caches. They can be
+# revalidated with their `ETag` and `Last-Modified` headers after that.
+BOOK_CACHE_MAX_AGE = env('BOOK_CACHE_MAX_AGE')
+CATALOG_VERSION_CACHE_TIMEOUT = env('CATALOG_VERSION_CACHE_TIMEOUT')
+
+# Book lists with at least this many books (according to the query planner's
+# estimate) give estimated counts. Zero means that counts are always exact.
+BOOK_COUNT_ESTIMATE_THRESHOLD = env('BOOK_COUNT_ESTIMATE_THRESHOLD')
+
+
+# This serves books from the documents that `updatecatalog` stores, instead of
+# serializing their related data for every request.
+BOOK_DOCUMENTS = env('BOOK_DOCUMENTS')
+
+# This serializes books with `FastBookSerializer`, which gives the same data as
+# `BookSerializer` with much less work per book.
+BOOK_FAST_SERIALIZER = env('BOOK_FAST_SERIALIZER')
+
+
+# This times the database queries, serialization and whole of each request,
+# giving the times in `Server-Timing` headers and histograms of them at
+# `/metrics`. The histograms are kept separately by each server process.
+# Anyone can read `/metrics`, so it should only be enabled behind a proxy that
+# keeps it private.
+REQUEST_METRICS = env('REQUEST_METRICS')
+
+# Book responses that take at least this many milliseconds to build (querying
+# and serializing books, but not rendering them) have their slowest query
+# stored for `manage.py slowqueries`, at most once per interval (in seconds)
+# for each combination of parameters. That command explains the queries with
+# `EXPLAIN (ANALYZE, BUFFERS)`, which runs them again, outside of requests.
+# Zero disables sampling.
+SLOW_QUERY_THRESHOLD = env('SLOW_QUERY_THRESHOLD')
+SLOW_QUERY_SAMPLE_INTERVAL = env('SLOW_QUERY_SAMPLE_INTERVAL')
+
+
+# Responses of at least this many bytes are compressed with Brotli (if the
+# `brotli` package is installed) or gzip for clients that accept them. Cached
+# book responses have their compressed content cached as well.
+RESPONSE_COMPRESSION = env('RESPONSE_COMPRESSION')
+COMPRESSION_MIN_SIZE = env('COMPRESSION_MIN_SIZE')
+
+
 # Settings for Django REST Framework JSON API
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly',
     ),
+    # This uses orjson if it is installed and gives the same JSON either way.
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
+        'books.renderers.BookJSONRenderer',
     ),
     'PAGE_SIZE': 32
 }
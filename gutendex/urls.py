@@ -11,5 +11,11 @@ router.register(r'books', views.BookViewSet)
 
 urlpatterns = [
     re_path(r'^$', TemplateView.as_view(template_name='home.html')),
+    re_path(r'^metrics$', views.metrics, name='metrics'),
+    re_path(
+        r'^books/export\.ndjson$',
+        views.BookViewSet.as_view({'get': 'export'}),
+        name='book-export'
+    ),
     re_path(r'^', include(router.urls)),
 ]